@@ -0,0 +1,176 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from datetime import timezone
+from typing import NamedTuple
+
+from sqlalchemy import event, func, inspect, select
+
+from app.auth.models import REVOCATION_CHANNEL, RevokedToken
+from app.auth.schemas import CacheStats
+from app.core.config import settings
+from app.core.db import sessionmanager
+from app.users.models import User
+
+PRINCIPAL_CHANNEL = 'principal_changes'
+REVOKED_PRUNE_MIN = 1000
+
+
+class Principal(NamedTuple):
+    id: int
+    username: str
+    role: str | None
+
+
+class PrincipalCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats = CacheStats(max_size=max_size, ttl_seconds=ttl)
+        self._entries: OrderedDict[str, tuple[float, Principal]] = OrderedDict()
+        self._listener = sessionmanager.listener(PRINCIPAL_CHANNEL, self._on_notify, self._resync)
+
+    def get(self, username: str) -> Principal | None:
+        entry = self._entries.get(username)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+        expires, principal = entry
+        if expires < time.monotonic():
+            del self._entries[username]
+            self.stats.expirations += 1
+            self.stats.misses += 1
+            return None
+        self._entries.move_to_end(username)
+        self.stats.hits += 1
+        return principal
+
+    def put(self, user: User) -> Principal:
+        principal = Principal(user.id, user.username, user.role)
+        if self.max_size <= 0:
+            return principal
+        self._entries[principal.username] = (time.monotonic() + self.ttl, principal)
+        self._entries.move_to_end(principal.username)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+        return principal
+
+    def invalidate(self, username: str) -> None:
+        if self._entries.pop(username, None) is not None:
+            self.stats.invalidations += 1
+
+    def clear(self) -> None:
+        self.stats.invalidations += len(self._entries)
+        self._entries.clear()
+
+    def report(self) -> CacheStats:
+        return self.stats.copy(update={'size': len(self._entries)})
+
+    async def start(self) -> None:
+        await self._listener.start()
+
+    async def stop(self) -> None:
+        await self._listener.stop()
+
+    async def _resync(self) -> None:
+        # changes made while nobody listened are unknown, start over
+        self.clear()
+
+    def _on_notify(self, connection, pid: int, channel: str, payload: str) -> None:
+        for username in json.loads(payload):
+            self.invalidate(username)
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class TokenCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.stats = CacheStats(max_size=max_size)
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._revoked: dict[str, float] = {}
+        self._prune_at = REVOKED_PRUNE_MIN
+        self._listener = sessionmanager.listener(REVOCATION_CHANNEL, self._on_notify, self._resync)
+
+    def get(self, digest: str) -> dict | None:
+        claims = self._entries.get(digest)
+        if claims is None:
+            self.stats.misses += 1
+            return None
+        if claims['exp'] < time.time():
+            del self._entries[digest]
+            self.stats.expirations += 1
+            self.stats.misses += 1
+            return None
+        self._entries.move_to_end(digest)
+        self.stats.hits += 1
+        return claims
+
+    def put(self, digest: str, claims: dict) -> None:
+        if self.max_size <= 0 or 'exp' not in claims:
+            return
+        self._entries[digest] = claims
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def is_revoked(self, digest: str) -> bool:
+        expires = self._revoked.get(digest)
+        if expires is None:
+            return False
+        if expires < time.time():
+            del self._revoked[digest]
+            return False
+        return True
+
+    def revoke(self, digest: str, expires: float) -> None:
+        self._revoked[digest] = expires
+        if len(self._revoked) >= self._prune_at:
+            self._prune_revoked()
+        if self._entries.pop(digest, None) is not None:
+            self.stats.invalidations += 1
+
+    def _prune_revoked(self) -> None:
+        # tokens that were never checked again would stay forever, pruning whenever the set has
+        # doubled keeps the cost per revocation constant
+        now = time.time()
+        self._revoked = {digest: expires for digest, expires in self._revoked.items() if expires >= now}
+        self._prune_at = max(REVOKED_PRUNE_MIN, 2 * len(self._revoked))
+
+    def report(self) -> CacheStats:
+        return self.stats.copy(update={'size': len(self._entries), 'revoked': len(self._revoked)})
+
+    async def start(self) -> None:
+        await self._listener.start()
+
+    async def stop(self) -> None:
+        await self._listener.stop()
+
+    async def _resync(self) -> None:
+        # revocations made while nobody listened are read back from the table
+        async with sessionmanager.session() as session:
+            for token in await RevokedToken.get_active(session):
+                self.revoke(token.digest, token.expires_at.replace(tzinfo=timezone.utc).timestamp())
+
+    def _on_notify(self, connection, pid: int, channel: str, payload: str) -> None:
+        digest, _, expires = payload.partition(':')
+        self.revoke(digest, float(expires))
+
+
+principals = PrincipalCache(settings.principal_cache_size, settings.principal_cache_ttl_seconds)
+tokens = TokenCache(settings.token_cache_size)
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_principal(mapper, connection, target: User) -> None:
+    # renames carry the old name in the attribute history
+    usernames = {target.username, *inspect(target).attrs.username.history.deleted}
+    for username in usernames:
+        principals.invalidate(username)
+    # other workers drop their entry once the transaction commits
+    connection.execute(select(func.pg_notify(PRINCIPAL_CHANNEL, json.dumps(sorted(usernames)))))
@@ -5,6 +5,7 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.auth.cache import Principal, principals, token_digest, tokens
 from app.auth.schemas import TokenData
 from app.core.config import settings
 from app.core.db import get_db
@@ -24,9 +25,16 @@ def create_access_token(data: dict) -> str:
     return encoded_jwt
 
 
-async def verify_token(session: AsyncSession, token: str, credentials_exception) -> User:
+async def verify_token(session: AsyncSession, token: str, credentials_exception) -> Principal:
+    digest = token_digest(token)
+    if tokens.is_revoked(digest):
+        raise credentials_exception
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        # a token seen before costs a dictionary lookup instead of a signature check
+        payload = tokens.get(digest)
+        if payload is None:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            tokens.put(digest, payload)
         # print(f'token {token}')
         username: str = payload.get("sub")
         # print(username)
@@ -34,11 +42,14 @@ async def verify_token(session: AsyncSession, token: str, credentials_exception)
             raise credentials_exception
         token_data = TokenData(username=username)
         # print(token_data)
+        principal = principals.get(token_data.username)
+        if principal is not None:
+            return principal
         user = await User.verify_username(session, username=token_data.username)
         # print(f'user {user.chats[0].users}')
         if not user:
             raise HTTPException(status_code=400, detail="Inactive user")
-        return user
+        return principals.put(user)
     except JWTError:
         raise credentials_exception
 
@@ -46,7 +57,7 @@ async def verify_token(session: AsyncSession, token: str, credentials_exception)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 
-async def get_current_user(session: AsyncSession = Depends(get_db), data: str = Depends(oauth2_scheme)) -> User:
+async def get_current_user(session: AsyncSession = Depends(get_db), data: str = Depends(oauth2_scheme)) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credenrtials",
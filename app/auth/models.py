@@ -0,0 +1,34 @@
+from datetime import datetime
+from typing import Type, TypeVar
+
+from sqlalchemy import DateTime, String, delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.core.db import Base
+
+R = TypeVar('R', bound='RevokedToken')
+
+REVOCATION_CHANNEL = 'token_revocations'
+
+
+class RevokedToken(Base):
+    __tablename__ = 'revoked_tokens'
+    digest: Mapped[str] = mapped_column(String(64), primary_key=True)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
+
+    @classmethod
+    async def revoke(cls: Type[R], session: AsyncSession, digest: str, expires: int) -> None:
+        query = insert(cls).values(digest=digest, expires_at=datetime.utcfromtimestamp(expires))
+        query = query.on_conflict_do_nothing()
+        await session.execute(query)
+        # rows are only needed until the token would have expired anyway
+        await session.execute(delete(cls).where(cls.expires_at < datetime.utcnow()))
+        await session.execute(select(func.pg_notify(REVOCATION_CHANNEL, f'{digest}:{expires}')))
+        await session.commit()
+
+    @classmethod
+    async def get_active(cls: Type[R], session: AsyncSession) -> list[R]:
+        result = await session.execute(select(cls).where(cls.expires_at >= datetime.utcnow()))
+        return result.scalars().all()
@@ -1,8 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
+from jose import JWTError, jwt
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.auth.jwt import create_access_token
+from app.auth.cache import token_digest, tokens
+from app.auth.jwt import ALGORITHM, SECRET_KEY, create_access_token, oauth2_scheme
+from app.auth.models import RevokedToken
 from app.core.db import get_db
 from app.users import hashing
 from app.users.models import User
@@ -15,8 +18,24 @@ async def login(request: OAuth2PasswordRequestForm = Depends(), session: AsyncSe
     user = await User.verify_username(session, request.username)
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Invalid Credentials")
-    if not hashing.verify_password(request.password, user.password):
+    valid, new_hash = await hashing.verify_and_update(request.password, user.password)
+    if not valid:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid Password")
+    if new_hash is not None:
+        await User.update_password(session, user.id, new_hash)
 
     access_token = create_access_token(data={"sub": user.username})
-    return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
+    return {"access_token": access_token, "token_type": "bearer"}
+
+
+@auth_router.post('/logout', status_code=status.HTTP_204_NO_CONTENT)
+async def logout(token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_db)):
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credenrtials",
+                            headers={"WWW-Authenticate": "Bearer"})
+    digest = token_digest(token)
+    await RevokedToken.revoke(session, digest, payload['exp'])
+    tokens.revoke(digest, payload['exp'])
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
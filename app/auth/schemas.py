@@ -12,4 +12,15 @@ class Token(BaseModel):
 
 
 class TokenData(BaseModel):
-    username: str | None = None
\ No newline at end of file
+    username: str | None = None
+
+class CacheStats(BaseModel):
+    max_size: int
+    ttl_seconds: float | None = None
+    size: int = 0
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+    revoked: int = 0
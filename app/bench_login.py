@@ -0,0 +1,74 @@
+# login throughput against event loop latency, argon2 inline on the loop vs the bounded hashing pool
+#   python -m app.bench_login --logins 200 --concurrency 50
+import argparse
+import asyncio
+import statistics
+import time
+
+from app.core.config import settings
+from app.users import hashing
+
+CHAT_REQUEST_INTERVAL = 0.005
+
+
+def percentile(samples: list[float], q: float) -> float:
+    if len(samples) < 2:
+        return samples[0] if samples else 0
+    return statistics.quantiles(samples, n=100)[q - 1]
+
+
+async def chat_requests(stop: asyncio.Event, latencies: list[float]) -> None:
+    # each request only needs the loop for a moment, its latency is the time spent waiting for it
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(CHAT_REQUEST_INTERVAL)
+        latencies.append(time.perf_counter() - started - CHAT_REQUEST_INTERVAL)
+
+
+async def inline_login(password: str, hashed: str) -> None:
+    hashing.pwd_context.verify_and_update(password, hashed)
+    await asyncio.sleep(0)
+
+
+async def pooled_login(password: str, hashed: str) -> None:
+    while True:
+        try:
+            await hashing.verify_and_update(password, hashed)
+            return
+        except hashing.HashingBusy:
+            await asyncio.sleep(0.01)
+
+
+async def run(mode: str, login, logins: int, concurrency: int, hashed: str) -> None:
+    stop = asyncio.Event()
+    latencies: list[float] = []
+    chat = [asyncio.create_task(chat_requests(stop, latencies)) for _ in range(10)]
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one() -> None:
+        async with limit:
+            await login('password', hashed)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await asyncio.gather(*chat)
+    print(f'{mode:>6}: {logins / elapsed:8.1f} logins/s, chat p50 {percentile(latencies, 50) * 1000:7.1f} ms, '
+          f'p99 {percentile(latencies, 99) * 1000:7.1f} ms, max {max(latencies) * 1000:7.1f} ms')
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logins', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+    hashed = hashing.get_hashed_password('password')
+    print(f'argon2 time_cost={settings.argon2_time_cost} memory_cost={settings.argon2_memory_cost} '
+          f'workers={settings.hash_workers}')
+    await run('inline', inline_login, args.logins, args.concurrency, hashed)
+    await run('pool', pooled_login, args.logins, args.concurrency, hashed)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+import asyncio
+import hashlib
+import logging
+import time
+
+from app.chat.schemas import AgentLoad
+from app.core.config import settings
+from app.core.db import sessionmanager
+from app.users.models import User
+
+logger = logging.getLogger(__name__)
+
+
+def is_agent(role: str | None) -> bool:
+    # superusers keep agent rights when agent_role names a separate role
+    return role in ('superuser', settings.agent_role)
+
+
+class RoundRobin:
+    def __init__(self):
+        self._last = 0
+
+    def choose(self, loads: dict[int, AgentLoad], user_id: int) -> int:
+        # continues after the last agent id, agents joining or leaving don't restart the rotation
+        agent_ids = sorted(loads)
+        agent_id = next((agent_id for agent_id in agent_ids if agent_id > self._last), agent_ids[0])
+        self._last = agent_id
+        return agent_id
+
+
+class LeastLoaded:
+    def choose(self, loads: dict[int, AgentLoad], user_id: int) -> int:
+        return min(loads.values(), key=lambda load: (load.open, load.chats, load.id)).id
+
+
+class Sticky:
+    def choose(self, loads: dict[int, AgentLoad], user_id: int) -> int:
+        # rendezvous hashing: the same agent on every worker, only an agent's own users move when it leaves
+        return max(loads, key=lambda agent_id: hashlib.blake2b(f'{agent_id}:{user_id}'.encode(),
+                                                               digest_size=8).digest())
+
+
+STRATEGIES = {
+    'round_robin': RoundRobin,
+    'least_loaded': LeastLoaded,
+    'sticky': Sticky,
+}
+
+
+class AgentPool:
+    def __init__(self, role: str, strategy: str, refresh_seconds: int):
+        self.role = role
+        self.strategy = STRATEGIES[strategy]()
+        self.refresh_seconds = refresh_seconds
+        self.refreshed_at: float | None = None
+        self._loads: dict[int, AgentLoad] = {}
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self.refresh_seconds > 0:
+            self._task = asyncio.create_task(self._refresh_forever())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _refresh_forever(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Refreshing agent loads failed")
+            await asyncio.sleep(self.refresh_seconds)
+
+    async def refresh(self) -> None:
+        async with sessionmanager.session() as session:
+            rows = await User.get_agent_loads(session, self.role)
+        self._loads = {row.id: AgentLoad.from_orm(row) for row in rows}
+        self.refreshed_at = time.time()
+
+    async def assign(self, user_ids: list[int]) -> list[int | None]:
+        if not self._loads:
+            await self.refresh()
+        agent_ids = []
+        for user_id in user_ids:
+            agent_id = self.strategy.choose(self._loads, user_id) if self._loads else None
+            if agent_id is not None:
+                # counted here until the next refresh, other workers see it then
+                load = self._loads[agent_id]
+                load.chats += 1
+                load.open += 1
+            agent_ids.append(agent_id)
+        return agent_ids
+
+    def report(self) -> list[AgentLoad]:
+        return [load.copy() for load in self._loads.values()]
+
+
+agents = AgentPool(settings.agent_role, settings.agent_strategy, settings.agent_refresh_seconds)
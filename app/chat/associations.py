@@ -6,5 +6,14 @@ association_table = Table(
     "association_table",
     Base.metadata,
     Column("chat_id", Integer, ForeignKey("chats.id"), primary_key=True),
-    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True)
-)
\ No newline at end of file
+    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True, index=True)
+)
+
+chat_reads = Table(
+    "chat_reads",
+    Base.metadata,
+    Column("chat_id", Integer, ForeignKey("chats.id", ondelete="CASCADE"), primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+    Column("last_read_message_id", Integer, nullable=True),
+    Column("unread_count", Integer, nullable=False, default=0, server_default='0')
+)
@@ -0,0 +1,178 @@
+import csv
+import json
+from datetime import datetime, timezone
+from typing import AsyncIterator
+
+from pydantic import ValidationError
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.chat.models import Chat, Message, File
+from app.chat.schemas import MessageImport, ImportReport, ImportRowError
+from app.users.models import User
+
+MAX_REPORTED_ERRORS = 1000
+MESSAGE_COLUMNS = ('id', 'message', 'created_at', 'user_id', 'chat_id')
+FILE_COLUMNS = ('name', 'path', 'size', 'message_id')
+
+
+async def iter_lines(stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    buffer = b''
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            yield line.rstrip(b'\r')
+    if buffer:
+        yield buffer.rstrip(b'\r')
+
+
+def decode_line(line: bytes) -> str:
+    # undecodable bytes fail the row they are in, not the whole import
+    try:
+        return line.decode('utf-8')
+    except UnicodeDecodeError as e:
+        raise ValueError(f'Invalid UTF-8: {e}')
+
+
+async def iter_ndjson(stream: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, dict | str]]:
+    line_no = 0
+    async for raw in iter_lines(stream):
+        line_no += 1
+        try:
+            line = decode_line(raw)
+        except ValueError as e:
+            yield line_no, str(e)
+            continue
+        if not line.strip():
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError as e:
+            yield line_no, f'Invalid JSON: {e}'
+
+
+async def iter_csv(stream: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, dict | str]]:
+    # a record may span several lines while a quoted field is still open
+    header = None
+    record, record_line, line_no, error = '', 0, 0, None
+    async for raw in iter_lines(stream):
+        line_no += 1
+        try:
+            line = decode_line(raw)
+        except ValueError as e:
+            # still followed to the end of its record so quoting stays in sync, then the record fails
+            line, error = raw.decode('utf-8', 'replace'), error or str(e)
+        if not record:
+            record_line = line_no
+        record = f'{record}\n{line}' if record else line
+        if record.count('"') % 2:
+            continue
+        if error:
+            yield record_line, error
+            record, error = '', None
+            continue
+        if not record.strip():
+            record = ''
+            continue
+        values = next(csv.reader([record]))
+        record = ''
+        if header is None:
+            header = values
+            continue
+        if len(values) != len(header):
+            yield record_line, f'Expected {len(header)} columns, got {len(values)}'
+            continue
+        row = dict(zip(header, values))
+        if row.get('file_path'):
+            row['files'] = [{'name': row.pop('file_name', None) or row['file_path'].split('/')[-1],
+                             'path': row.pop('file_path'), 'size': row.pop('file_size', None) or 0}]
+        yield record_line, {key: value for key, value in row.items() if value != ''}
+
+
+def to_utc(value: datetime | None) -> datetime:
+    if value is None:
+        return datetime.utcnow()
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class MessageImporter:
+    def __init__(self, session: AsyncSession, batch_size: int):
+        self.session = session
+        self.batch_size = batch_size
+        self.report = ImportReport()
+        self._batch: list[tuple[int, MessageImport]] = []
+        self._chats: set[int] = set()
+        self._users: set[int] = set()
+
+    def fail(self, line: int, error: str) -> None:
+        self.report.failed += 1
+        if len(self.report.errors) < MAX_REPORTED_ERRORS:
+            self.report.errors.append(ImportRowError(line=line, error=error))
+
+    async def add(self, line: int, data: dict | str) -> None:
+        if isinstance(data, str):
+            self.fail(line, data)
+            return
+        try:
+            self._batch.append((line, MessageImport.parse_obj(data)))
+        except ValidationError as e:
+            self.fail(line, str(e).replace('\n', ' '))
+            return
+        if len(self._batch) >= self.batch_size:
+            await self.flush()
+
+    async def _remember(self, model, ids: set[int], known: set[int]) -> None:
+        missing = ids - known
+        if missing:
+            result = await self.session.execute(select(model.id).where(model.id.in_(missing)))
+            known.update(result.scalars().all())
+
+    async def flush(self) -> None:
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        await self._remember(Chat, {item.chat_id for _, item in batch}, self._chats)
+        await self._remember(User, {item.user_id for _, item in batch}, self._users)
+        rows = []
+        for line, item in batch:
+            if item.chat_id not in self._chats:
+                self.fail(line, f'Chat {item.chat_id} not found')
+            elif item.user_id not in self._users:
+                self.fail(line, f'User {item.user_id} not found')
+            else:
+                rows.append((line, item))
+        if not rows:
+            return
+        try:
+            await self._copy(rows)
+            await self.session.commit()
+        except Exception as e:
+            await self.session.rollback()
+            for line, _ in rows:
+                self.fail(line, f'Batch rejected: {e}')
+            return
+        self.report.messages += len(rows)
+        self.report.files += sum(len(item.files) for _, item in rows)
+
+    async def _copy(self, rows: list[tuple[int, MessageImport]]) -> None:
+        # COPY cannot return generated keys, so ids are reserved from the sequence first
+        sequence = func.nextval(func.pg_get_serial_sequence(Message.__tablename__, 'id'))
+        result = await self.session.execute(select(sequence).select_from(func.generate_series(1, len(rows))))
+        ids = result.scalars().all()
+        messages, files = [], []
+        for message_id, (_, item) in zip(ids, rows):
+            messages.append((message_id, item.message, to_utc(item.created_at), item.user_id, item.chat_id))
+            files.extend((f.name, f.path, f.size, message_id) for f in item.files)
+        connection = await self.session.connection()
+        raw_connection = await connection.get_raw_connection()
+        driver_connection = raw_connection.driver_connection
+        await driver_connection.copy_records_to_table(Message.__tablename__, records=messages,
+                                                      columns=MESSAGE_COLUMNS)
+        if files:
+            await driver_connection.copy_records_to_table(File.__tablename__, records=files, columns=FILE_COLUMNS)
+        chat_ids = {item.chat_id for _, item in rows}
+        await self.session.execute(update(Chat).where(Chat.id.in_(chat_ids)).values(version=Chat.version + 1)
+                                   .execution_options(synchronize_session=False))
@@ -0,0 +1,27 @@
+import logging
+
+from app.chat.models import Chat, ChatJob, Message
+from app.core.config import settings
+from app.core.db import sessionmanager
+
+logger = logging.getLogger(__name__)
+
+
+async def run_chat_job(job_id: int) -> None:
+    async with sessionmanager.session() as session:
+        job = await ChatJob.get_by_id(session, job_id)
+        if job is None:
+            return
+        chat_id, kind = job.chat_id, job.kind
+        await ChatJob.set_status(session, job_id, 'running')
+        try:
+            if kind == 'clear':
+                await Message.clear_messages_by_chat_id(session, chat_id, settings.chat_delete_batch_size, job_id)
+            else:
+                await Chat.delete_chat(session, chat_id, settings.chat_delete_batch_size, job_id)
+        except Exception as e:
+            logger.exception("Chat job %s (%s of chat %s) failed", job_id, kind, chat_id)
+            await session.rollback()
+            await ChatJob.set_status(session, job_id, 'failed', str(e))
+            return
+        await ChatJob.set_status(session, job_id, 'done')
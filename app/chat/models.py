@@ -1,11 +1,17 @@
+import json
 from datetime import datetime
-from typing import TypeVar, TYPE_CHECKING, Type, Annotated, Self
+from typing import TypeVar, TYPE_CHECKING, Type, Annotated, Self, Sequence
 
-from sqlalchemy import Integer, Table, Column, ForeignKey, String, select, delete, DateTime, update
+from sqlalchemy import Integer, Table, Column, ForeignKey, String, select, delete, DateTime, update, Index, tuple_
+from sqlalchemy import Row, and_, func, true, insert, or_, Computed, REAL, cast
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import Mapped, mapped_column, relationship, WriteOnlyMapped
+from sqlalchemy.orm import Mapped, mapped_column, relationship, WriteOnlyMapped, aliased, raiseload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.interfaces import ORMOption
 
-from app.chat.associations import association_table
+from app.chat.agents import agents
+from app.chat.associations import association_table, chat_reads
 from app.chat.schemas import FileUpload
 from app.core.db import Base
 # if TYPE_CHECKING:
@@ -15,41 +21,69 @@ from app.users.schemas import UserGetName
 C = TypeVar('C', bound='Chat')
 M = TypeVar('M', bound='Message')
 F = TypeVar('F', bound='File')
+J = TypeVar('J', bound='ChatJob')
+
+MESSAGE_CHANNEL = 'chat_messages'
+SEARCH_CONFIG = 'russian'
+GREETING = 'Беседа начата'
 
 
 class Chat(Base):
     __tablename__ = "chats"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
-    users: Mapped[list['User']] = relationship('User', secondary=association_table, back_populates="chats", lazy='selectin')
-    messages: Mapped[list['Message']] = relationship("Message", back_populates="chat", lazy='selectin')
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default='0')
+    users: Mapped[list['User']] = relationship('User', secondary=association_table, back_populates="chats", lazy='raise')
+    messages: Mapped[list['Message']] = relationship("Message", back_populates="chat", lazy='raise')
 
     @classmethod
     async def create_chat(cls: Type[Self], session: AsyncSession, user_id: int) -> Self:
-        user = await User.get_by_id(session, user_id)
+        # flushed only, the caller commits together with whatever it writes into the chat
+        user = await User.get_by_id(session, user_id, USER_CHATS)
         if user.chats:
             return user.chats[0]
-        superuser = await User.get_superuser(session)
-        users = [user, superuser]
-        # print(users)
+        agent_id, = await agents.assign([user_id])
         chat = cls()
-        # chat.messages = []
-        chat.users.extend(users)
-        # print(chat)
         session.add(chat)
-        await session.commit()
-        await session.refresh(chat)
+        await session.flush()
+        members = [{'chat_id': chat.id, 'user_id': member_id} for member_id in (user_id, agent_id)
+                   if member_id is not None]
+        await session.execute(insert(association_table), members)
+        await session.execute(insert(chat_reads), members)
         return chat
 
+    @classmethod
+    async def create_for_users(cls: Type[C], session: AsyncSession, user_ids: list[int], greeting: str = GREETING,
+                               notify: bool = True) -> list[int]:
+        # a chat with an agent per new user, opened by the user's greeting; the caller commits
+        agent_ids = await agents.assign(user_ids)
+        query = insert(cls).returning(cls.id, sort_by_parameter_order=True)
+        chat_ids = (await session.scalars(query, [{'version': 1}] * len(user_ids))).all()
+        members = [{'chat_id': chat_id, 'user_id': user_id, 'unread_count': 0}
+                   for chat_id, user_id in zip(chat_ids, user_ids)]
+        members += [{'chat_id': chat_id, 'user_id': agent_id, 'unread_count': 1}
+                    for chat_id, agent_id in zip(chat_ids, agent_ids) if agent_id is not None]
+        await session.execute(insert(association_table), [{'chat_id': m['chat_id'], 'user_id': m['user_id']}
+                                                          for m in members])
+        await session.execute(insert(chat_reads), members)
+        query = insert(Message).returning(Message.id, sort_by_parameter_order=True)
+        message_ids = (await session.scalars(query, [{'message': greeting, 'chat_id': chat_id, 'user_id': user_id}
+                                                     for chat_id, user_id in zip(chat_ids, user_ids)])).all()
+        if notify:
+            for message_id, chat_id in zip(message_ids, chat_ids):
+                await Message.notify_created(session, message_id, chat_id)
+        return chat_ids
+
     @classmethod
     async def get_chats(cls: Type[C], session: AsyncSession, limit: int = 100, offset: int = 0) -> list[C]:
-        chats = select(cls).limit(limit).offset(offset)
+        chats = select(cls).limit(limit).offset(offset).options(*CHAT_WITH_MESSAGES)
         result = await session.execute(chats)
         return result.scalars().all()
 
     @classmethod
-    async def get_chat(cls: Type[C], session: AsyncSession, chat_id: int) -> C | None:
-        chat = select(cls).where(cls.id == chat_id)
+    async def get_chat(cls: Type[C], session: AsyncSession, chat_id: int,
+                       options: Sequence[ORMOption] = ()) -> C | None:
+        chat = select(cls).where(cls.id == chat_id).options(*options)
         result = await session.execute(chat)
         res = result.scalars().first()
 
@@ -57,36 +91,159 @@ class Chat(Base):
 
     @classmethod
     async def get_chat_by_user(cls: Type[C], session: AsyncSession, user_id: int) -> list[C]:
-        chat = select(cls).join(cls.users).where(User.id == user_id)
+        chat = select(cls).join(cls.users).where(User.id == user_id).options(*CHAT_WITH_MESSAGES)
         result = await session.execute(chat)
         res = result.scalars().all()
         return res
 
     @classmethod
-    async def delete_chat(cls: Type[C], session: AsyncSession, chat_id: int) -> C:
-        query = delete(cls).where(cls.id == chat_id)
-        data = await session.execute(query)
+    async def get_version(cls: Type[C], session: AsyncSession, chat_id: int) -> int | None:
+        result = await session.execute(select(cls.version).where(cls.id == chat_id))
+        return result.scalar()
+
+    @classmethod
+    async def bump_version(cls: Type[C], session: AsyncSession, chat_id: int) -> None:
+        query = update(cls).where(cls.id == chat_id).values(version=cls.version + 1)
+        await session.execute(query.execution_options(synchronize_session=False))
+
+    @classmethod
+    async def add_unread(cls: Type[C], session: AsyncSession, chat_id: int, author_id: int) -> None:
+        query = (
+            update(chat_reads)
+            .where(chat_reads.c.chat_id == chat_id, chat_reads.c.user_id != author_id)
+            .values(unread_count=chat_reads.c.unread_count + 1)
+        )
+        await session.execute(query)
+
+    @classmethod
+    async def remove_unread(cls: Type[C], session: AsyncSession, chat_id: int, author_id: int,
+                            message_id: int) -> None:
+        query = (
+            update(chat_reads)
+            .where(chat_reads.c.chat_id == chat_id, chat_reads.c.user_id != author_id,
+                   chat_reads.c.unread_count > 0,
+                   or_(chat_reads.c.last_read_message_id.is_(None),
+                       chat_reads.c.last_read_message_id < message_id))
+            .values(unread_count=chat_reads.c.unread_count - 1)
+        )
+        await session.execute(query)
+
+    @classmethod
+    async def mark_read(cls: Type[C], session: AsyncSession, chat_id: int, user_id: int,
+                        message_id: int | None = None) -> Row | None:
+        if message_id is None:
+            last = (
+                select(Message.id)
+                .where(Message.chat_id == chat_id)
+                .order_by(Message.created_at.desc(), Message.id.desc())
+                .limit(1)
+            )
+            message_id = (await session.execute(last)).scalar()
+            unread = 0
+        else:
+            anchor = select(Message.created_at).where(Message.id == message_id, Message.chat_id == chat_id)
+            created_at = (await session.execute(anchor)).scalar()
+            if created_at is None:
+                return None
+            # bounded by the messages after the cursor, served by the chat history index
+            newer = select(func.count()).where(Message.chat_id == chat_id, Message.user_id != user_id,
+                                               tuple_(Message.created_at, Message.id) > tuple_(created_at, message_id))
+            unread = (await session.execute(newer)).scalar()
+        query = (
+            update(chat_reads)
+            .where(chat_reads.c.chat_id == chat_id, chat_reads.c.user_id == user_id)
+            .values(last_read_message_id=message_id, unread_count=unread)
+            .returning(chat_reads.c.chat_id, chat_reads.c.last_read_message_id, chat_reads.c.unread_count)
+        )
+        result = await session.execute(query)
+        state = result.first()
         await session.commit()
-        return data.scalars().first()
+        return state
+
+    @classmethod
+    async def is_member(cls: Type[C], session: AsyncSession, chat_id: int, user_id: int) -> bool:
+        query = select(association_table.c.chat_id).where(association_table.c.chat_id == chat_id,
+                                                          association_table.c.user_id == user_id)
+        result = await session.execute(query)
+        return result.first() is not None
+
+    @classmethod
+    async def get_inbox(cls: Type[C], session: AsyncSession, user_id: int, counterpart_role: str,
+                        limit: int = 50, offset: int = 0) -> tuple[list[Row], int]:
+        member = association_table.alias('member')
+        other = association_table.alias('other')
+        counterpart = aliased(User)
+        author = aliased(User)
+        last = (
+            select(Message.id, Message.message, Message.created_at, Message.user_id)
+            .where(Message.chat_id == cls.id)
+            .order_by(Message.created_at.desc(), Message.id.desc())
+            .limit(1)
+            .lateral('last_message')
+        )
+        query = (
+            select(
+                cls.id,
+                counterpart.id.label('user_id'),
+                counterpart.username.label('user_username'),
+                counterpart.role.label('user_role'),
+                last.c.id.label('message_id'),
+                last.c.message,
+                last.c.created_at,
+                author.username.label('message_username'),
+                func.coalesce(chat_reads.c.unread_count, 0).label('unread'),
+                func.count().over().label('total'),
+            )
+            .join(member, and_(member.c.chat_id == cls.id, member.c.user_id == user_id))
+            .outerjoin(chat_reads, and_(chat_reads.c.chat_id == cls.id, chat_reads.c.user_id == user_id))
+            .join(other, other.c.chat_id == cls.id)
+            .join(counterpart, and_(counterpart.id == other.c.user_id, counterpart.role == counterpart_role))
+            .join(last, true())
+            .join(author, author.id == last.c.user_id)
+            .order_by(last.c.created_at.desc(), cls.id.desc())
+            .limit(limit)
+            .offset(offset)
+        )
+        result = await session.execute(query)
+        rows = result.all()
+        total = rows[0].total if rows else 0
+        return rows, total
+
+    @classmethod
+    async def delete_chat(cls: Type[C], session: AsyncSession, chat_id: int, batch_size: int = 1000,
+                          job_id: int | None = None) -> bool:
+        await Message.delete_by_chat_id(session, chat_id, batch_size, keep_first=False, job_id=job_id)
+        await session.execute(delete(chat_reads).where(chat_reads.c.chat_id == chat_id))
+        await session.execute(delete(association_table).where(association_table.c.chat_id == chat_id))
+        result = await session.execute(delete(cls).where(cls.id == chat_id))
+        await session.commit()
+        return result.rowcount > 0
 
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index('ix_messages_chat_id_created_at_id', 'chat_id', 'created_at', 'id'),
+        Index('ix_messages_search_vector', 'search_vector', postgresql_using='gin'),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     message: Mapped[str] = mapped_column(String, nullable=False)
+    search_vector: Mapped[str] = mapped_column(TSVECTOR, Computed(f"to_tsvector('{SEARCH_CONFIG}', message)",
+                                                                  persisted=True), deferred=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
-    user: Mapped['User'] = relationship('User', back_populates="messages", lazy="selectin")
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    user: Mapped['User'] = relationship('User', back_populates="messages", lazy="raise")
     chat_id: Mapped[int] = mapped_column(ForeignKey('chats.id', ondelete="CASCADE"))
-    chat: Mapped['Chat'] = relationship('Chat', back_populates="messages", lazy="selectin")
-    files: Mapped[list['File']] = relationship('File', back_populates='message', lazy='selectin')
+    chat: Mapped['Chat'] = relationship('Chat', back_populates="messages", lazy="raise")
+    files: Mapped[list['File']] = relationship('File', back_populates='message', lazy='raise')
 
     def __repr__(self):
         return f"CHAT {self.id}, {self.message}"
 
     @classmethod
-    async def create_message(cls: Type[M], session: AsyncSession, message: str, chat_id: int, user_id: int) -> M:
+    async def create_message(cls: Type[M], session: AsyncSession, message: str, chat_id: int, user_id: int,
+                             notify: bool = True) -> M:
         chat = await Chat.get_chat(session, chat_id)
         if not chat:
             chat = await Chat.create_chat(session, user_id)
@@ -96,35 +253,136 @@ class Message(Base):
             user_id=user_id
         )
         session.add(message)
+        await session.flush()
+        message_id = message.id
+        await Chat.bump_version(session, chat.id)
+        await Chat.add_unread(session, chat.id, user_id)
+        if notify:
+            await cls.notify_created(session, message_id, chat.id)
         await session.commit()
-        await session.refresh(message)
+        return await cls.get_message_by_id(session, message_id)
+
+    @classmethod
+    async def create_with_files(cls: Type[M], session: AsyncSession, message: str, chat_id: int, user_id: int,
+                                files: list[dict]) -> M:
+        # nothing is committed here, the caller commits once and cleans up stored objects on failure
+        chat = await Chat.get_chat(session, chat_id)
+        if not chat:
+            chat = await Chat.create_chat(session, user_id)
+        message = cls(message=message, chat_id=chat.id, user_id=user_id)
+        session.add(message)
+        await session.flush()
+        rows = []
+        if files:
+            query = insert(File).returning(File, sort_by_parameter_order=True)
+            rows = (await session.scalars(query, [{**file, 'message_id': message.id} for file in files])).all()
+        set_committed_value(message, 'files', rows)
+        await Chat.bump_version(session, chat.id)
+        await Chat.add_unread(session, chat.id, user_id)
+        await cls.notify_created(session, message.id, chat.id)
         return message
 
+    @classmethod
+    async def notify_created(cls: Type[M], session: AsyncSession, message_id: int, chat_id: int) -> None:
+        # delivered to every worker's listener once the surrounding transaction commits
+        payload = json.dumps({'chat_id': chat_id, 'message_id': message_id})
+        await session.execute(select(func.pg_notify(MESSAGE_CHANNEL, payload)))
+
+    @classmethod
+    async def notify_attachment(cls: Type[M], session: AsyncSession, message_id: int, chat_id: int,
+                                file_id: int) -> None:
+        # a file added to an existing message, subscribers get only the file and not the message again
+        payload = json.dumps({'chat_id': chat_id, 'message_id': message_id, 'file_id': file_id})
+        await session.execute(select(func.pg_notify(MESSAGE_CHANNEL, payload)))
+
     # @classmethod
     # async def update_message_files(cls: Type[M], session: AsyncSession, message_id: str, files: ):
 
     @classmethod
     async def get_message_by_id(cls: Type[M], session: AsyncSession, message_id: int) -> M:
-        message = select(cls).where(cls.id == message_id)
+        message = select(cls).where(cls.id == message_id).options(*MESSAGE)
         result = await session.execute(message)
         return result.scalars().first()
 
     @classmethod
     async def get_messages_by_chat_id(cls: Type[M], session: AsyncSession, chat_id: int) -> list[M]:
-        messages = select(cls).where(cls.chat_id == chat_id)
+        messages = select(cls).where(cls.chat_id == chat_id).options(*MESSAGE)
         result = await session.execute(messages)
         return result.scalars().all()
 
+    @classmethod
+    async def get_messages_page(cls: Type[M], session: AsyncSession, chat_id: int, before: int | None = None,
+                                after: int | None = None, limit: int = 50) -> tuple[list[M], int | None]:
+        # newest page without a cursor; next_cursor continues in the same direction
+        key = tuple_(cls.created_at, cls.id)
+        query = select(cls).where(cls.chat_id == chat_id).options(*MESSAGE)
+        cursor_id = after if after is not None else before
+        anchor = None
+        if cursor_id is not None:
+            anchor = (await session.execute(
+                select(cls.created_at, cls.id).where(cls.id == cursor_id, cls.chat_id == chat_id))).first()
+        # a deleted or cleared cursor message falls back to id order, ids grow with created_at
+        if after is not None:
+            query = query.where(key > tuple_(*anchor) if anchor else cls.id > after)
+            query = query.order_by(cls.created_at, cls.id)
+        else:
+            if before is not None:
+                query = query.where(key < tuple_(*anchor) if anchor else cls.id < before)
+            query = query.order_by(cls.created_at.desc(), cls.id.desc())
+        result = await session.execute(query.limit(limit + 1))
+        messages = list(result.scalars().all())
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        next_cursor = messages[-1].id if has_more else None
+        if after is None:
+            messages.reverse()
+        return messages, next_cursor
+
+    @classmethod
+    async def search(cls: Type[M], session: AsyncSession, text: str, member_id: int | None = None,
+                     chat_id: int | None = None, user_id: int | None = None, date_from: datetime | None = None,
+                     date_to: datetime | None = None, cursor: tuple[float, int] | None = None,
+                     limit: int = 20) -> tuple[list[Row], tuple[float, int] | None]:
+        ts_query = func.websearch_to_tsquery(SEARCH_CONFIG, text)
+        rank = func.ts_rank_cd(cls.search_vector, ts_query)
+        query = select(cls.id, cls.chat_id, cls.user_id, cls.created_at, cls.message, rank.label('rank'))
+        query = query.where(cls.search_vector.op('@@')(ts_query))
+        if member_id is not None:
+            query = query.where(cls.chat_id.in_(
+                select(association_table.c.chat_id).where(association_table.c.user_id == member_id)))
+        if chat_id is not None:
+            query = query.where(cls.chat_id == chat_id)
+        if user_id is not None:
+            query = query.where(cls.user_id == user_id)
+        if date_from is not None:
+            query = query.where(cls.created_at >= date_from)
+        if date_to is not None:
+            query = query.where(cls.created_at < date_to)
+        if cursor is not None:
+            query = query.where(tuple_(rank, cls.id) < tuple_(cast(cursor[0], REAL), cursor[1]))
+        page = query.order_by(rank.desc(), cls.id.desc()).limit(limit + 1).subquery()
+        # headlines are the expensive part, build them for the page only
+        snippet = func.ts_headline(SEARCH_CONFIG, page.c.message, ts_query, 'MaxFragments=2, MaxWords=20, MinWords=5')
+        hits = select(page.c.id, page.c.chat_id, page.c.user_id, page.c.created_at, page.c.rank,
+                      snippet.label('snippet')).order_by(page.c.rank.desc(), page.c.id.desc())
+        result = await session.execute(hits)
+        rows = result.all()
+        next_cursor = (rows[limit - 1].rank, rows[limit - 1].id) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
     @classmethod
     async def get_messages_by_user_id(cls: Type[M], session: AsyncSession, user_id: int) -> list[M]:
-        messages = select(cls).where(cls.user_id == user_id)
+        messages = select(cls).where(cls.user_id == user_id).options(*MESSAGE)
         result = await session.execute(messages)
         return result.scalars().all()
 
     @classmethod
     async def delete_message_by_id(cls: Type[M], session: AsyncSession, message_id: int) -> bool:
-        msg = delete(cls).where(cls.id == message_id)
-        await session.execute(msg)
+        msg = delete(cls).where(cls.id == message_id).returning(cls.chat_id, cls.user_id)
+        deleted = (await session.execute(msg)).first()
+        if deleted is not None:
+            await Chat.bump_version(session, deleted.chat_id)
+            await Chat.remove_unread(session, deleted.chat_id, deleted.user_id, message_id)
         await session.commit()
         return True
 
@@ -136,26 +394,96 @@ class Message(Base):
         return True
 
     @classmethod
-    async def clear_messages_by_chat_id(cls: Type[M], session: AsyncSession, chat_id: int) -> None:
-        try:
-            messages = await cls.get_messages_by_chat_id(session, chat_id)
-            mes = []
-            for i in range(len(messages)):
-                if i != 0:
-                    mes.append(messages[i].id)
-            await cls.delete_all_messages(session, mes)
-        except Exception as e:
-            print(e)
+    async def delete_batch(cls: Type[M], session: AsyncSession, chat_id: int, batch_size: int,
+                           keep_first: bool) -> int:
+        batch = aliased(cls)
+        ids = select(batch.id).where(batch.chat_id == chat_id)
+        if keep_first:
+            first = aliased(cls)
+            ids = ids.where(batch.id != select(first.id).where(first.chat_id == chat_id)
+                            .order_by(first.created_at, first.id).limit(1).scalar_subquery())
+        query = delete(cls).where(cls.id.in_(ids.order_by(batch.id).limit(batch_size)))
+        result = await session.execute(query.execution_options(synchronize_session=False))
+        return result.rowcount
+
+    @classmethod
+    async def delete_by_chat_id(cls: Type[M], session: AsyncSession, chat_id: int, batch_size: int,
+                                keep_first: bool, job_id: int | None = None) -> int:
+        # every batch is its own short transaction so the table is never locked for the whole chat
+        total = 0
+        while True:
+            deleted = await cls.delete_batch(session, chat_id, batch_size, keep_first)
+            total += deleted
+            if deleted:
+                await Chat.bump_version(session, chat_id)
+                if job_id is not None:
+                    await ChatJob.add_progress(session, job_id, deleted)
+            await session.commit()
+            if deleted < batch_size:
+                return total
+
+    @classmethod
+    async def clear_messages_by_chat_id(cls: Type[M], session: AsyncSession, chat_id: int, batch_size: int = 1000,
+                                        job_id: int | None = None) -> int:
+        total = await cls.delete_by_chat_id(session, chat_id, batch_size, keep_first=True, job_id=job_id)
+        await session.execute(update(chat_reads).where(chat_reads.c.chat_id == chat_id).values(unread_count=0))
+        await session.commit()
+        return total
+
+
+class ChatJob(Base):
+    __tablename__ = "chat_jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    chat_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    kind: Mapped[str] = mapped_column(String(20), nullable=False)
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default='pending')
+    deleted: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    error: Mapped[str | None] = mapped_column(String, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+    @classmethod
+    async def create_job(cls: Type[J], session: AsyncSession, chat_id: int, kind: str) -> J:
+        job = cls(chat_id=chat_id, kind=kind)
+        session.add(job)
+        await session.commit()
+        await session.refresh(job)
+        return job
+
+    @classmethod
+    async def get_by_id(cls: Type[J], session: AsyncSession, job_id: int) -> J | None:
+        result = await session.execute(select(cls).where(cls.id == job_id))
+        return result.scalars().first()
+
+    @classmethod
+    async def add_progress(cls: Type[J], session: AsyncSession, job_id: int, deleted: int) -> None:
+        query = update(cls).where(cls.id == job_id).values(deleted=cls.deleted + deleted)
+        await session.execute(query.execution_options(synchronize_session=False))
+
+    @classmethod
+    async def set_status(cls: Type[J], session: AsyncSession, job_id: int, status: str,
+                         error: str | None = None) -> None:
+        values = {'status': status, 'error': error}
+        if status in ('done', 'failed'):
+            values['finished_at'] = datetime.utcnow()
+        query = update(cls).where(cls.id == job_id).values(**values)
+        await session.execute(query.execution_options(synchronize_session=False))
+        await session.commit()
 
 
 class File(Base):
     __tablename__ = "files"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(String, nullable=False, default=datetime.now().strftime("%Y_%m_%d_%H_%M_%S_%f"))
-    path: Mapped[str] = mapped_column(String, nullable=False)
+    path: Mapped[str] = mapped_column(String, nullable=False, index=True)
     size: Mapped[int] = mapped_column(Integer, nullable=False)
-    message_id: Mapped[int] = mapped_column(ForeignKey('messages.id', ondelete="CASCADE"))
-    message: Mapped['Message'] = relationship('Message', back_populates='files', lazy='selectin')
+    sha256: Mapped[str | None] = mapped_column(String(64), nullable=True, index=True)
+    width: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    height: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    thumbnail_path: Mapped[str | None] = mapped_column(String, nullable=True, index=True)
+    message_id: Mapped[int] = mapped_column(ForeignKey('messages.id', ondelete="CASCADE"), index=True)
+    message: Mapped['Message'] = relationship('Message', back_populates='files', lazy='raise')
 
     def __repr__(self):
         print(f'File from message: {self.message_id}. Name: {self.name}, Path: {self.path}, Size: {self.size}')
@@ -168,6 +496,12 @@ class File(Base):
         await session.refresh(file)
         return file
 
+    @classmethod
+    async def add_file(cls: Type[F], session: AsyncSession, data: FileUpload) -> F:
+        # inserted without committing, the caller commits together with the rest of its changes
+        query = insert(cls).returning(cls)
+        return (await session.scalars(query, [data.dict()])).one()
+
     @classmethod
     async def get_all(cls: Type[F], session: AsyncSession, limit: int = 100, offset: int = 0) -> list[F]:
         data = await session.execute(select(cls).offset(offset).limit(limit))
@@ -179,6 +513,11 @@ class File(Base):
         data = await session.execute(query)
         return data.scalars().first()
 
+    @classmethod
+    async def get_by_ids(cls: Type[F], session: AsyncSession, file_ids: list[int]) -> list[F]:
+        data = await session.execute(select(cls).where(cls.id.in_(file_ids)).order_by(cls.id))
+        return data.scalars().all()
+
     @classmethod
     async def get_by_path(cls: Type[F], session: AsyncSession, path: str) -> F:
         query = select(cls).where(cls.path == path)
@@ -204,6 +543,42 @@ class File(Base):
         await session.commit()
         return data.scalars().first()
 
+    @classmethod
+    async def get_existing_paths(cls: Type[F], session: AsyncSession, paths: list[str]) -> set[str]:
+        query = select(cls.path).where(cls.path.in_(paths)).union(
+            select(cls.thumbnail_path).where(cls.thumbnail_path.in_(paths)))
+        data = await session.execute(query)
+        return set(data.scalars().all())
+
+    @classmethod
+    async def get_paths_after(cls: Type[F], session: AsyncSession, file_id: int, limit: int) -> list[Row]:
+        query = select(cls.id, cls.path).where(cls.id > file_id).order_by(cls.id).limit(limit)
+        data = await session.execute(query)
+        return data.all()
+
+    @classmethod
+    async def delete_many(cls: Type[F], session: AsyncSession, file_ids: list[int]) -> int:
+        query = delete(cls).where(cls.id.in_(file_ids)).returning(cls.message_id)
+        message_ids = (await session.execute(query)).scalars().all()
+        if message_ids:
+            chats = select(Message.chat_id).where(Message.id.in_(message_ids))
+            await session.execute(update(Chat).where(Chat.id.in_(chats)).values(version=Chat.version + 1)
+                                  .execution_options(synchronize_session=False))
+        await session.commit()
+        return len(message_ids)
+
+    @classmethod
+    async def set_preview(cls: Type[F], session: AsyncSession, file_id: int, width: int, height: int,
+                          thumbnail_path: str) -> None:
+        query = (update(cls).where(cls.id == file_id)
+                 .values(width=width, height=height, thumbnail_path=thumbnail_path).returning(cls.message_id))
+        message_id = (await session.execute(query.execution_options(synchronize_session=False))).scalar()
+        if message_id is not None:
+            chats = select(Message.chat_id).where(Message.id == message_id)
+            await session.execute(update(Chat).where(Chat.id.in_(chats)).values(version=Chat.version + 1)
+                                  .execution_options(synchronize_session=False))
+        await session.commit()
+
     @classmethod
     async def update_file_size(cls: Type[F], session: AsyncSession, size: int, path: str) -> F:
         data_d = {'size': size}
@@ -212,3 +587,9 @@ class File(Base):
         data = await session.execute(query)
         await session.commit()
         return data.scalars().first()
+
+
+MESSAGE: tuple[ORMOption, ...] = (selectinload(Message.files), raiseload('*'))
+CHAT_WITH_MESSAGES: tuple[ORMOption, ...] = (selectinload(Chat.messages).selectinload(Message.files), raiseload('*'))
+USER_CHATS: tuple[ORMOption, ...] = (selectinload(User.chats), raiseload('*'))
+USER_WITH_MESSAGES: tuple[ORMOption, ...] = (selectinload(User.messages).selectinload(Message.files), raiseload('*'))
@@ -0,0 +1,47 @@
+import asyncio
+import logging
+
+from app.chat.models import File
+from app.core.config import settings
+from app.core.db import sessionmanager
+from app.utils.storage import remove_local, storage
+from app.utils.thumbnails import is_image, thumbnail_key, thumbnails
+from app.utils.uploads import staging_path
+
+logger = logging.getLogger(__name__)
+
+
+async def render_preview(path: str) -> tuple[int, int] | None:
+    # the pool works on local files, remote objects are copied to staging first
+    staged = await asyncio.to_thread(staging_path)
+    targets = [(size, f'{staged}.{size}.jpg') for size in settings.thumbnail_sizes]
+    source = await storage.fetch(path, staged)
+    try:
+        # identical uploads share thumbnails, only sizes nobody rendered yet are rendered
+        stats = await asyncio.gather(*(storage.stat(thumbnail_key(path, size)) for size, _ in targets))
+        missing = [target for target, stat in zip(targets, stats) if stat is None]
+        size = await thumbnails.render(source, missing)
+        if size is not None:
+            for thumb_size, target in missing:
+                await storage.put(target, thumbnail_key(path, thumb_size))
+        return size
+    finally:
+        await asyncio.to_thread(remove_local, [staged, *(target for _, target in targets)])
+
+
+async def generate_previews(file_ids: list[int]) -> None:
+    async with sessionmanager.session() as session:
+        files = [(file.id, file.name, file.path) for file in await File.get_by_ids(session, file_ids)]
+        # no transaction is held open while the pool renders
+        await session.rollback()
+        for file_id, name, path in files:
+            if not is_image(name):
+                continue
+            key = thumbnail_key(path, settings.thumbnail_sizes[0])
+            try:
+                size = await render_preview(path)
+            except Exception:
+                logger.exception("Thumbnail of file %s failed", file_id)
+                continue
+            if size is not None:
+                await File.set_preview(session, file_id, *size, key)
@@ -0,0 +1,161 @@
+import asyncio
+import json
+import logging
+
+from fastapi import WebSocket, WebSocketDisconnect, status
+from fastapi.encoders import jsonable_encoder
+
+from app.auth.cache import Principal
+from app.chat.agents import is_agent
+from app.chat.models import Chat, File, Message, MESSAGE_CHANNEL
+from app.chat.schemas import FileDB, MessageGet
+from app.core.config import settings
+from app.core.db import sessionmanager
+
+logger = logging.getLogger(__name__)
+
+
+class Subscriber:
+    def __init__(self, websocket: WebSocket, user: Principal, queue_size: int):
+        self.websocket = websocket
+        self.user_id = user.id
+        self.is_agent = is_agent(user.role)
+        self.chats: set[int] = set()
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = asyncio.Event()
+
+    def push(self, data: str) -> None:
+        # never block the fan-out on a slow socket, the connection is dropped instead
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            self.overflowed.set()
+
+    async def send_forever(self) -> None:
+        while True:
+            data = await self.queue.get()
+            await self.websocket.send_text(data)
+
+
+class MessageBroker:
+    def __init__(self):
+        self._subscribers: dict[int, set[Subscriber]] = {}
+        self._listener = sessionmanager.listener(MESSAGE_CHANNEL, self._on_notify)
+        self._pending: asyncio.Queue[dict] = asyncio.Queue()
+        self._delivery: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        await self._listener.start()
+        self._delivery = asyncio.create_task(self._deliver_forever())
+
+    async def stop(self) -> None:
+        await self._listener.stop()
+        if self._delivery is not None:
+            self._delivery.cancel()
+            self._delivery = None
+
+    def _on_notify(self, connection, pid: int, channel: str, payload: str) -> None:
+        data = json.loads(payload)
+        if not self._subscribers.get(data['chat_id']):
+            return
+        # notifications arrive in commit order, one consumer keeps them in that order
+        self._pending.put_nowait(data)
+
+    async def _deliver_forever(self) -> None:
+        while True:
+            data = await self._pending.get()
+            try:
+                await self._deliver(data)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Delivering message %s failed", data['message_id'])
+
+    async def _deliver(self, data: dict) -> None:
+        # one fetch per worker, then the same payload goes to every local subscriber
+        async with sessionmanager.session() as session:
+            if 'file_id' in data:
+                payload = await self._attachment_payload(session, data)
+            else:
+                payload = await self._message_payload(session, data)
+        if payload is None:
+            return
+        for subscriber in list(self._subscribers.get(data['chat_id'], ())):
+            subscriber.push(payload)
+
+    @staticmethod
+    async def _message_payload(session, data: dict) -> str | None:
+        message = await Message.get_message_by_id(session, data['message_id'])
+        if not message:
+            return None
+        return json.dumps({'type': 'message', 'message': jsonable_encoder(MessageGet.from_orm(message).sign())})
+
+    @staticmethod
+    async def _attachment_payload(session, data: dict) -> str | None:
+        file = await File.get_by_id(session, data['file_id'])
+        if not file:
+            return None
+        return json.dumps({'type': 'attachment', 'chat_id': data['chat_id'], 'message_id': data['message_id'],
+                           'file': jsonable_encoder(FileDB.from_orm(file).sign())})
+
+    def subscribe(self, subscriber: Subscriber, chat_id: int) -> None:
+        subscriber.chats.add(chat_id)
+        self._subscribers.setdefault(chat_id, set()).add(subscriber)
+
+    def unsubscribe(self, subscriber: Subscriber, chat_id: int) -> None:
+        subscriber.chats.discard(chat_id)
+        subscribers = self._subscribers.get(chat_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[chat_id]
+
+    async def _can_subscribe(self, subscriber: Subscriber, chat_id: int) -> bool:
+        if subscriber.is_agent:
+            return True
+        async with sessionmanager.session() as session:
+            return await Chat.is_member(session, chat_id, subscriber.user_id)
+
+    async def _receive_forever(self, subscriber: Subscriber) -> None:
+        while True:
+            data = await subscriber.websocket.receive_json()
+            if not isinstance(data, dict):
+                data = {}
+            action, chat_id = data.get('action'), data.get('chat_id')
+            if not isinstance(chat_id, int):
+                subscriber.push(json.dumps({'type': 'error', 'detail': 'chat_id is required'}))
+            elif action == 'subscribe':
+                if await self._can_subscribe(subscriber, chat_id):
+                    self.subscribe(subscriber, chat_id)
+                    subscriber.push(json.dumps({'type': 'subscribed', 'chat_id': chat_id}))
+                else:
+                    subscriber.push(json.dumps({'type': 'error', 'detail': 'Permission denied!', 'chat_id': chat_id}))
+            elif action == 'unsubscribe':
+                self.unsubscribe(subscriber, chat_id)
+                subscriber.push(json.dumps({'type': 'unsubscribed', 'chat_id': chat_id}))
+            else:
+                subscriber.push(json.dumps({'type': 'error', 'detail': f'Unknown action {action}'}))
+
+    async def serve(self, websocket: WebSocket, user: Principal) -> None:
+        subscriber = Subscriber(websocket, user, settings.ws_send_queue_size)
+        tasks = [
+            asyncio.create_task(subscriber.send_forever()),
+            asyncio.create_task(self._receive_forever(subscriber)),
+            asyncio.create_task(subscriber.overflowed.wait()),
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            if subscriber.overflowed.is_set():
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+            for task in done:
+                if not task.cancelled() and isinstance(task.exception(), Exception) \
+                        and not isinstance(task.exception(), WebSocketDisconnect):
+                    logger.warning("WebSocket of user %s failed: %r", subscriber.user_id, task.exception())
+        finally:
+            for task in tasks:
+                task.cancel()
+            for chat_id in list(subscriber.chats):
+                self.unsubscribe(subscriber, chat_id)
+
+
+broker = MessageBroker()
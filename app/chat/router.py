@@ -1,18 +1,31 @@
-import os.path
-import aiofiles
-from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, Form, status
+import asyncio
+from datetime import datetime
+
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, Request, UploadFile, Form, Query, WebSocket, status
 from fastapi import File as fa_file
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.auth.jwt import get_current_user
-from app.chat.models import Chat, Message, File
-from app.chat.schemas import ChatGet, MessageGet, ChatGetAdmin, MessageLast, MessageCreate
-from app.chat.schemas import FileDB, FileUpload
-from app.core.db import get_db
-from app.users.models import User
-from app.users.schemas import UserGetName, UserGetFull
-from app.utils.uploads import generate_path, generate_filename
+from app.auth.jwt import get_current_user, verify_token
+from app.chat.models import Chat, ChatJob, Message, File, CHAT_WITH_MESSAGES
+from app.chat.schemas import ChatGet, MessageGet, ChatGetAdmin, MessageLast, MessageCreate, MessagePage
+from app.chat.schemas import AgentLoad, ChatInbox, ChatJobGet, ChatReadGet, ChatReadUpdate, UserGetName1, MessageSearchPage
+from app.chat.schemas import FileDB, FileUpload, ImportReport, StorageGcReport, UploadCreate, UploadFinish, UploadGet
+from app.chat.agents import agents, is_agent
+from app.chat.imports import MessageImporter, iter_csv, iter_ndjson
+from app.chat.jobs import run_chat_job
+from app.chat.previews import generate_previews
+from app.chat.realtime import broker
+from app.chat.storage_gc import collector
+from app.core.config import settings
+from app.core.db import get_db, sessionmanager
+from app.users.schemas import UserGetFull
+from app.utils.http import etag_matches, file_response
+from app.utils.resumable import UploadError, append_upload, create_upload, finish_upload, load_upload
+from app.utils.signing import signing_epoch, verify_download
+from app.utils.storage import storage
+from app.utils.thumbnails import thumbnail_key, thumbnail_name
+from app.utils.uploads import StoredObject, generate_filename, store_upload
 
 chat_router = APIRouter()
 CHUNK_SIZE = 1024*1024
@@ -28,72 +41,134 @@ async def get_chats(offset: int = 0, limit: int = 100, session: AsyncSession = D
 @chat_router.post("/create", response_model=ChatGet)
 async def create_chat(user_id: int, session: AsyncSession = Depends(get_db)):
     chat = await Chat.create_chat(session, user_id)
-    return chat
+    chat_id = chat.id
+    await session.commit()
+    return await Chat.get_chat(session, chat_id, CHAT_WITH_MESSAGES)
+
+
+@chat_router.get("/search", response_model=MessageSearchPage)
+async def search_messages(q: str = Query(..., min_length=1, max_length=256), chat_id: int | None = None,
+                          user_id: int | None = None, date_from: datetime | None = None,
+                          date_to: datetime | None = None, cursor: str | None = None,
+                          limit: int = Query(20, ge=1, le=100), session: AsyncSession = Depends(get_db),
+                          current_user: UserGetFull = Depends(get_current_user)):
+    position = None
+    if cursor is not None:
+        try:
+            rank, message_id = cursor.split(':')
+            position = (float(rank), int(message_id))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f'Invalid cursor {cursor}')
+    member_id = None if is_agent(current_user.role) else current_user.id
+    hits, next_position = await Message.search(session, q, member_id, chat_id, user_id, date_from, date_to,
+                                               position, limit)
+    next_cursor = f'{next_position[0]!r}:{next_position[1]}' if next_position else None
+    return MessageSearchPage(hits=hits, next_cursor=next_cursor)
+
+
+@chat_router.websocket("/ws")
+async def chat_updates(websocket: WebSocket, token: str):
+    credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                                          detail="Could not validate credenrtials")
+    try:
+        async with sessionmanager.session() as session:
+            current_user = await verify_token(session, token, credentials_exception)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    await broker.serve(websocket, current_user)
+
+
+async def can_view_chat(session: AsyncSession, chat_id: int, user: UserGetFull) -> bool:
+    return is_agent(user.role) or await Chat.is_member(session, chat_id, user.id)
 
 
 @chat_router.get("/{chat_id}", response_model=ChatGet)
 async def get_chat(chat_id: int, session: AsyncSession = Depends(get_db),
                    current_user: UserGetFull = Depends(get_current_user)):
-    chat = await Chat.get_chat(session, chat_id)
-    return chat
+    chat = await Chat.get_chat(session, chat_id, CHAT_WITH_MESSAGES)
+    if not chat:
+        return chat
+    chat = ChatGet.from_orm(chat)
+    # download links only go to members, everyone else still needs a token for /download
+    return chat.sign() if await can_view_chat(session, chat_id, current_user) else chat
+
+
+@chat_router.get("/{chat_id}/messages", response_model=MessagePage)
+async def get_messages_by_chat(chat_id: int, request: Request, response: Response, before: int | None = None,
+                               after: int | None = None, since_id: int | None = None,
+                               limit: int = Query(50, ge=1, le=200), session: AsyncSession = Depends(get_db),
+                               current_user: UserGetFull = Depends(get_current_user)):
+    after = since_id if since_id is not None else after
+    if before is not None and after is not None:
+        raise HTTPException(status_code=400, detail="Use either before or after cursor")
+    if not await can_view_chat(session, chat_id, current_user):
+        raise HTTPException(status_code=400, detail="Permission denied!")
+    version = await Chat.get_version(session, chat_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail=f'Chat {chat_id} not found')
+    # the signing epoch is part of the tag, cached pages never carry expired download urls;
+    # so is the normalized page, since_id and after give the same tag
+    cursor = f'b{before}' if before is not None else f'a{after}' if after is not None else ''
+    etag = f'"{chat_id}.{version}.{signing_epoch()}.{cursor}.{limit}"'
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    messages, next_cursor = await Message.get_messages_page(session, chat_id, before, after, limit)
+    page = MessagePage(messages=messages, next_cursor=next_cursor)
+    for message in page.messages:
+        message.sign()
+    return page
+
+
+def build_inbox(rows, total: int) -> ChatInbox:
+    chats = []
+    for row in rows:
+        user = UserGetName1(id=row.user_id, username=row.user_username, role=row.user_role)
+        last_message = MessageLast(id=row.message_id, message=row.message,
+                                   created_at=row.created_at, username=row.message_username)
+        chats.append(ChatGetAdmin(id=row.id, user=user, last_message=last_message, unread=row.unread))
+    return ChatInbox(total=total, chats=chats)
 
 
-@chat_router.get("/{chat_id}/messages", response_model=list[MessageGet])
-async def get_messages_by_chat(chat_id: int, session: AsyncSession = Depends(get_db)):
-    messages = await Message.get_messages_by_chat_id(session, chat_id)
-    return messages
+@chat_router.get("/admin/agents", response_model=list[AgentLoad])
+async def get_agents(refresh: bool = False, current_user: UserGetFull = Depends(get_current_user)):
+    if not is_agent(current_user.role):
+        raise HTTPException(status_code=400, detail="Permission denied!")
+    if refresh:
+        await agents.refresh()
+    return agents.report()
 
 
-@chat_router.get("/admin/{user_id}", response_model=list[ChatGetAdmin])
-async def get_chat_by_admin(user_id: int, session: AsyncSession = Depends(get_db),
+@chat_router.get("/admin/{user_id}", response_model=ChatInbox)
+async def get_chat_by_admin(user_id: int, offset: int = 0, limit: int = Query(50, ge=1, le=200),
+                            session: AsyncSession = Depends(get_db),
                             current_user: UserGetFull = Depends(get_current_user)):
-    if current_user.role != "superuser":
+    if not is_agent(current_user.role):
         raise HTTPException(status_code=400, detail="Permission denied!")
-    chat = await Chat.get_chat_by_user(session, user_id)
-
-    chats = []
-
-    for c in chat:
-        # print("messages", c.messages)
-        msg = sorted(c.messages, key=lambda x: x.created_at)
-        last_msg = msg[-1]
-        last_msg_user = await User.get_by_id(session, last_msg.user_id)
-        user = None
-        for u in c.users:
-            if u.role == "guest":
-                user = u
-        user = UserGetName(id=user.id, username=user.username, role=user.role)
-        last_message = MessageLast(id=last_msg.id, message=last_msg.message,
-                                   created_at=last_msg.created_at, username=last_msg_user.username)
-        current_chat = ChatGetAdmin(id=c.id, user=user, last_message=last_message)
-        chats.append(current_chat)
-    return chats
+    rows, total = await Chat.get_inbox(session, user_id, "guest", limit, offset)
+    return build_inbox(rows, total)
 
 
-@chat_router.get("/user/{user_id}", response_model=list[ChatGetAdmin])
-async def get_chat_by_user(user_id: int, session: AsyncSession = Depends(get_db),
+@chat_router.get("/user/{user_id}", response_model=ChatInbox)
+async def get_chat_by_user(user_id: int, offset: int = 0, limit: int = Query(50, ge=1, le=200),
+                           session: AsyncSession = Depends(get_db),
                            current_user: UserGetFull = Depends(get_current_user)):
-    if current_user.role == "superuser":
+    if is_agent(current_user.role):
         raise HTTPException(status_code=400, detail="Permission denied!")
-    chat = await Chat.get_chat_by_user(session, user_id)
+    rows, total = await Chat.get_inbox(session, user_id, settings.agent_role, limit, offset)
+    return build_inbox(rows, total)
 
-    chats = []
 
-    for c in chat:
-        # print("messages", c.messages)
-        msg = sorted(c.messages, key=lambda x: x.created_at)
-        last_msg = msg[-1]
-        last_msg_user = await User.get_by_id(session, last_msg.user_id)
-        user = None
-        for u in c.users:
-            if u.role == "superuser":
-                user = u
-        user = UserGetName(id=user.id, username=user.username, role=user.role)
-        last_message = MessageLast(id=last_msg.id, message=last_msg.message,
-                                   created_at=last_msg.created_at, username=last_msg_user.username)
-        current_chat = ChatGetAdmin(id=c.id, user=user, last_message=last_message)
-        chats.append(current_chat)
-    return chats
+@chat_router.post("/{chat_id}/read", response_model=ChatReadGet)
+async def mark_chat_read(chat_id: int, read: ChatReadUpdate, session: AsyncSession = Depends(get_db),
+                         current_user: UserGetFull = Depends(get_current_user)):
+    state = await Chat.mark_read(session, chat_id, current_user.id, read.message_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail=f'Chat {chat_id} or message {read.message_id} not found')
+    return state
 
 
 @chat_router.get("/user/{user_id}/messages", response_model=list[MessageGet])
@@ -117,56 +192,193 @@ async def create_message(message: MessageCreate,
     return message
 
 
-@chat_router.post("/message_file/create", response_model=MessageGet)
-async def create_message_with_file(message: MessageCreate = Depends(),
-                                   files: list[UploadFile] | None = None,
-                                   session: AsyncSession = Depends(get_db),
-                                   current_user: UserGetFull = Depends(get_current_user)):
-    # print(message)
-    message = await Message.create_message(session, message.message, message.chat_id, message.user_id)
-    message_id = message.id
-    files_db = []
-    if files:
-        for file in files:
-            path = generate_path()
-            if not os.path.exists(path):
-                os.makedirs(path, mode=0o666)
-            name = generate_filename(file.filename)
-            path = os.path.join(path, name)
+@chat_router.post("/message/import", response_model=ImportReport)
+async def import_messages(request: Request, batch_size: int = Query(5000, ge=1, le=50000),
+                          session: AsyncSession = Depends(get_db),
+                          current_user: UserGetFull = Depends(get_current_user)):
+    if current_user.role != "superuser":
+        raise HTTPException(status_code=400, detail="Permission denied!")
+    content_type = request.headers.get('content-type', '')
+    rows = iter_csv(request.stream()) if content_type.startswith('text/csv') else iter_ndjson(request.stream())
+    importer = MessageImporter(session, batch_size)
+    async for line, data in rows:
+        await importer.add(line, data)
+    await importer.flush()
+    return importer.report
+
+
+async def store_uploads(files: list[UploadFile]) -> list[tuple[str, StoredObject]]:
+    slots = asyncio.Semaphore(settings.upload_concurrency)
+
+    async def store(file: UploadFile) -> tuple[str, StoredObject]:
+        async with slots:
             try:
-                # content = await file.read()
-                async with aiofiles.open(path, 'wb') as f:
-                    while chunk := await file.read(CHUNK_SIZE):
-                        await f.write(chunk)
-                f_db = FileUpload(name=name, path=path, size=1, message_id=message_id)
-                await File.create_file(session, f_db)
-            except Exception as e:
-                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                                    detail=f'There was an error uploading file: {e}')
+                return generate_filename(file.filename), await store_upload(file, CHUNK_SIZE)
             finally:
                 await file.close()
-            # print(path)
-    message = await Message.get_message_by_id(session, message_id)
-    # print(message)
-    # print(message.user_id, message.chat_id, message.message, message.files)
-    return message
 
+    results = await asyncio.gather(*map(store, files), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        await discard_objects([result for result in results if not isinstance(result, BaseException)])
+        raise errors[0]
+    return results
 
-@chat_router.delete("/delete/{chat_id}", response_model=ChatGet)
-async def delete_chat_by_id(chat_id: int, session: AsyncSession = Depends(get_db)):
-    chat = await Chat.delete_chat(session, chat_id)
-    return chat
 
+async def discard_objects(stored: list[tuple[str, StoredObject]]) -> None:
+    # only objects this request created, and only while no committed row points at them
+    keys = [obj.path for _, obj in stored if obj.created]
+    if not keys:
+        return
+    async with sessionmanager.session() as session:
+        referenced = await File.get_existing_paths(session, keys)
+    await storage.delete([key for key in keys if key not in referenced])
 
-@chat_router.get('/download/{file_id}', response_class=FileResponse)
-async def download_file(file_id: int,
+
+@chat_router.post("/message_file/create", response_model=MessageGet)
+async def create_message_with_file(background_tasks: BackgroundTasks,
+                                   message: MessageCreate = Depends(),
+                                   files: list[UploadFile] | None = None,
+                                   session: AsyncSession = Depends(get_db),
+                                   current_user: UserGetFull = Depends(get_current_user)):
+    try:
+        stored = await store_uploads(files or [])
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f'There was an error uploading file: {e}')
+    rows = [{'name': name, 'path': obj.path, 'size': obj.size, 'sha256': obj.sha256} for name, obj in stored]
+    try:
+        message = await Message.create_with_files(session, message.message, message.chat_id, message.user_id, rows)
+        # built before the commit expires the instance, no re-query is needed
+        message_db = MessageGet.from_orm(message)
+        await session.commit()
+    except BaseException:
+        await session.rollback()
+        await discard_objects(stored)
+        raise
+    if message_db.files:
+        background_tasks.add_task(generate_previews, [file.id for file in message_db.files])
+    return message_db.sign()
+
+
+def upload_headers(upload: dict, offset: int) -> dict:
+    return {'Upload-Offset': str(offset), 'Upload-Length': str(upload['length']), 'Cache-Control': 'no-store'}
+
+
+async def get_upload(upload_id: str, user_id: int) -> dict:
+    try:
+        return await load_upload(upload_id, user_id)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+
+@chat_router.post("/uploads", response_model=UploadGet, status_code=status.HTTP_201_CREATED)
+async def create_upload_session(upload: UploadCreate, request: Request, response: Response,
+                                current_user: UserGetFull = Depends(get_current_user)):
+    if upload.length > settings.upload_max_size:
+        raise HTTPException(status_code=413, detail=f'Upload is larger than {settings.upload_max_size} bytes')
+    upload = await create_upload(current_user.id, upload.filename, upload.length)
+    response.headers['Location'] = str(request.url_for('get_upload_session', upload_id=upload['id']))
+    response.headers.update(upload_headers(upload, 0))
+    return UploadGet(offset=0, **upload)
+
+
+@chat_router.head("/uploads/{upload_id}")
+async def get_upload_offset(upload_id: str, current_user: UserGetFull = Depends(get_current_user)):
+    upload = await get_upload(upload_id, current_user.id)
+    return Response(headers=upload_headers(upload, upload['offset']))
+
+
+@chat_router.get("/uploads/{upload_id}", response_model=UploadGet)
+async def get_upload_session(upload_id: str, response: Response,
+                             current_user: UserGetFull = Depends(get_current_user)):
+    upload = await get_upload(upload_id, current_user.id)
+    response.headers.update(upload_headers(upload, upload['offset']))
+    return upload
+
+
+@chat_router.patch("/uploads/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def append_upload_chunk(upload_id: str, request: Request, upload_offset: int = Header(..., ge=0),
+                              current_user: UserGetFull = Depends(get_current_user)):
+    if request.headers.get('content-type') != 'application/offset+octet-stream':
+        raise HTTPException(status_code=415, detail='Content-Type must be application/offset+octet-stream')
+    upload = await get_upload(upload_id, current_user.id)
+    try:
+        offset = await append_upload(upload, upload_offset, request.stream())
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return Response(status_code=status.HTTP_204_NO_CONTENT, headers=upload_headers(upload, offset))
+
+
+@chat_router.post("/uploads/{upload_id}/finish", response_model=FileDB)
+async def finish_upload_session(upload_id: str, finish: UploadFinish, background_tasks: BackgroundTasks,
+                                session: AsyncSession = Depends(get_db),
+                                current_user: UserGetFull = Depends(get_current_user)):
+    upload = await get_upload(upload_id, current_user.id)
+    message = await Message.get_message_by_id(session, finish.message_id)
+    if not message:
+        raise HTTPException(status_code=404, detail=f'Message {finish.message_id} not found')
+    if message.user_id != current_user.id and current_user.role != "superuser":
+        raise HTTPException(status_code=400, detail="Permission denied!")
+    chat_id = message.chat_id
+    try:
+        stored = await finish_upload(upload)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    f_db = FileUpload(name=generate_filename(upload['filename']), path=stored.path, size=stored.size,
+                      sha256=stored.sha256, message_id=finish.message_id)
+    file = await File.add_file(session, f_db)
+    await Chat.bump_version(session, chat_id)
+    await Message.notify_attachment(session, finish.message_id, chat_id, file.id)
+    # built before the commit expires the instance
+    file_db = FileDB.from_orm(file)
+    await session.commit()
+    background_tasks.add_task(generate_previews, [file_db.id])
+    return file_db.sign()
+
+
+@chat_router.delete("/delete/{chat_id}", response_model=ChatJobGet, status_code=status.HTTP_202_ACCEPTED)
+async def delete_chat_by_id(chat_id: int, background_tasks: BackgroundTasks, session: AsyncSession = Depends(get_db)):
+    job = await ChatJob.create_job(session, chat_id, 'delete')
+    background_tasks.add_task(run_chat_job, job.id)
+    return job
+
+
+@chat_router.get("/jobs/{job_id}", response_model=ChatJobGet)
+async def get_chat_job(job_id: int, session: AsyncSession = Depends(get_db)):
+    job = await ChatJob.get_by_id(session, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f'Job {job_id} not found')
+    return job
+
+
+@chat_router.api_route('/download/{file_id}', methods=['GET', 'HEAD'], response_class=FileResponse)
+async def download_file(file_id: int, request: Request,
+                        variant: str = Query('original', regex=r'^(original|thumb\d*)$'),
                         session: AsyncSession = Depends(get_db),
                         current_user: UserGetFull = Depends(get_current_user)):
     file = await File.get_by_id(session, file_id)
     if not file:
         raise HTTPException(status_code=404, detail=f'File {file_id} not found')
-    filename = file.path.split('/')[-1]
-    return FileResponse(path=file.path, media_type='application/octet-stream', filename=filename)
+    if variant != 'original' and file.thumbnail_path:
+        # thumb is the first configured size, thumb<size> any other one
+        size = int(variant[5:]) if variant[5:] else None
+        if size is not None and size not in settings.thumbnail_sizes:
+            raise HTTPException(status_code=404, detail=f'No {size}px thumbnail, sizes are {settings.thumbnail_sizes}')
+        key = file.thumbnail_path if size is None else thumbnail_key(file.path, size)
+        return await file_response(request, key, thumbnail_name(file.name), media_type='image/jpeg')
+    # content-addressed objects never change, their digest is a strong validator
+    return await file_response(request, file.path, file.name, etag=file.sha256,
+                               immutable=file.sha256 is not None)
+
+
+@chat_router.api_route('/signed/{token}', methods=['GET', 'HEAD'], response_class=FileResponse)
+async def download_signed_file(token: str, request: Request):
+    file = verify_download(token)
+    if file is None:
+        raise HTTPException(status_code=403, detail='Download link is invalid or expired')
+    return await file_response(request, file['path'], file['name'], etag=file['sha256'],
+                               immutable=file['sha256'] is not None)
 
 
 @chat_router.get('/files/all', response_model=list[FileDB])
@@ -175,9 +387,28 @@ async def get_all_files(offset: int = 0, limit: int = 100, session: AsyncSession
     return files
 
 
-@chat_router.get('/{chat_id}/clear')
-async def clear_chat(chat_id: int, session: AsyncSession = Depends(get_db),
+@chat_router.post('/files/gc', response_model=StorageGcReport)
+async def collect_files(dry_run: bool = True, current_user: UserGetFull = Depends(get_current_user)):
+    if current_user.role != "superuser":
+        raise HTTPException(status_code=400, detail="Permission denied!")
+    report = await collector.collect(dry_run)
+    if report is None:
+        raise HTTPException(status_code=409, detail="Storage collection is already running")
+    return report
+
+
+@chat_router.get('/files/gc', response_model=StorageGcReport | None)
+async def get_files_collection(current_user: UserGetFull = Depends(get_current_user)):
+    if current_user.role != "superuser":
+        raise HTTPException(status_code=400, detail="Permission denied!")
+    return collector.last_report
+
+
+@chat_router.get('/{chat_id}/clear', response_model=ChatJobGet, status_code=status.HTTP_202_ACCEPTED)
+async def clear_chat(chat_id: int, background_tasks: BackgroundTasks, session: AsyncSession = Depends(get_db),
                      current_user: UserGetFull = Depends(get_current_user)):
     if current_user.role != "superuser":
         raise HTTPException(status_code=400, detail="Permission denied!")
-    await Message.clear_messages_by_chat_id(session, chat_id)
+    job = await ChatJob.create_job(session, chat_id, 'clear')
+    background_tasks.add_task(run_chat_job, job.id)
+    return job
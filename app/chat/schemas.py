@@ -1,7 +1,11 @@
 from datetime import datetime
 from typing import TYPE_CHECKING
 
-from pydantic import BaseModel, constr
+from pydantic import BaseModel, conint, constr
+
+from app.core.config import settings
+from app.utils.signing import download_url
+from app.utils.thumbnails import thumbnail_key, thumbnail_name
 
 # from app.users.models import User
 if TYPE_CHECKING:
@@ -15,6 +19,7 @@ class FileBase(BaseModel):
 class FileUpload(FileBase):
     path: str
     size: int
+    sha256: str | None = None
     message_id: int
 
     class Config:
@@ -23,11 +28,66 @@ class FileUpload(FileBase):
 
 class FileDB(FileUpload):
     id: int
+    width: int | None = None
+    height: int | None = None
+    thumbnail_path: str | None = None
+    url: str | None = None
+    thumbnail_url: str | None = None
+    # every configured size by longest side, thumbnail_url is the first one
+    thumbnail_urls: dict[int, str] = {}
+
+    def sign(self) -> 'FileDB':
+        # only for callers already allowed to see the chat, a signed url needs no login
+        self.url = download_url(self.id, self.path, self.name, self.sha256)
+        if self.thumbnail_path:
+            name = thumbnail_name(self.name)
+            self.thumbnail_url = download_url(self.id, self.thumbnail_path, name)
+            self.thumbnail_urls = {size: download_url(self.id, thumbnail_key(self.path, size), name)
+                                   for size in settings.thumbnail_sizes}
+        return self
 
     class Config:
         orm_mode = True
 
 
+class FileImport(FileBase):
+    path: str
+    size: int
+
+
+class UploadCreate(BaseModel):
+    filename: constr(min_length=1, max_length=255)
+    length: conint(gt=0)
+
+
+class UploadGet(BaseModel):
+    id: str
+    filename: str
+    length: int
+    offset: int
+    expires_at: datetime
+
+
+class UploadFinish(BaseModel):
+    message_id: int
+
+
+class StorageGcReport(BaseModel):
+    dry_run: bool
+    started_at: datetime
+    elapsed: float = 0
+    scanned_objects: int = 0
+    orphaned_objects: int = 0
+    reclaimed_bytes: int = 0
+    # unreferenced objects outside the content-addressed layout, reported but never deleted
+    legacy_objects: int = 0
+    scanned_rows: int = 0
+    dangling_rows: int = 0
+    expired_uploads: int = 0
+    stale_staged: int = 0
+    objects_per_second: float = 0
+
+
 class ChatBase(BaseModel):
     id: int
     # users: list[User] = []
@@ -47,21 +107,73 @@ class MessageCreate(MessageBase):
     chat_id: int
 
 
+class MessageImport(BaseModel):
+    chat_id: int
+    user_id: int
+    message: str
+    created_at: datetime | None
+    files: list[FileImport] = []
+
+
+class ImportRowError(BaseModel):
+    line: int
+    error: str
+
+
+class ImportReport(BaseModel):
+    messages: int = 0
+    files: int = 0
+    failed: int = 0
+    errors: list[ImportRowError] = []
+
+
 class MessageGet(MessageBase):
     user_id: int
     chat_id: int
     created_at: datetime
     files: list[FileDB] = []
 
+    def sign(self) -> 'MessageGet':
+        for file in self.files:
+            file.sign()
+        return self
+
     class Config:
         orm_mode = True
 
 
-class ChatGet(ChatBase):
+class MessagePage(BaseModel):
+    messages: list[MessageGet] = []
+    next_cursor: int | None
+
+
+class MessageSearchHit(BaseModel):
+    id: int
+    chat_id: int
+    user_id: int
+    created_at: datetime
+    rank: float
+    snippet: str
+
+    class Config:
+        orm_mode = True
+
+
+class MessageSearchPage(BaseModel):
+    hits: list[MessageSearchHit] = []
+    next_cursor: str | None
 
+
+class ChatGet(ChatBase):
+    version: int = 0
     messages: list[MessageGet] = []
     # users: list['UserGetName'] = []
 
+    def sign(self) -> 'ChatGet':
+        for message in self.messages:
+            message.sign()
+        return self
+
     class Config:
         orm_mode = True
 
@@ -83,6 +195,50 @@ class MessageLast(MessageBase):
 class ChatGetAdmin(ChatBase):
     user: UserGetName1
     last_message: MessageLast
+    unread: int = 0
+
+    class Config:
+        orm_mode = True
+
+
+class ChatReadUpdate(BaseModel):
+    message_id: int | None = None
+
+
+class ChatReadGet(BaseModel):
+    chat_id: int
+    last_read_message_id: int | None
+    unread_count: int
+
+    class Config:
+        orm_mode = True
+
+
+class ChatJobGet(BaseModel):
+    id: int
+    chat_id: int
+    kind: str
+    status: str
+    deleted: int
+    error: str | None
+    created_at: datetime
+    finished_at: datetime | None
+
+    class Config:
+        orm_mode = True
+
+
+class ChatInbox(BaseModel):
+    total: int
+    chats: list[ChatGetAdmin] = []
+
+
+class AgentLoad(BaseModel):
+    id: int
+    username: str
+    chats: int = 0
+    # chats with messages the agent has not read yet
+    open: int = 0
 
     class Config:
         orm_mode = True
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+from sqlalchemy import select, func
+
+from app.chat.models import File
+from app.chat.schemas import StorageGcReport
+from app.core.config import settings
+from app.core.db import sessionmanager
+from app.utils.resumable import sweep_uploads
+from app.utils.storage import storage
+from app.utils.thumbnails import thumbnail_source
+from app.utils.uploads import OBJECTS_DIR, sweep_staged
+
+logger = logging.getLogger(__name__)
+
+GC_LOCK_ID = 0x57495345
+
+
+class StorageCollector:
+    def __init__(self):
+        self.last_report: StorageGcReport | None = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if settings.storage_gc_interval_seconds > 0:
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run_forever(self) -> None:
+        while True:
+            await asyncio.sleep(settings.storage_gc_interval_seconds)
+            try:
+                await self.collect(settings.storage_gc_dry_run)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Storage garbage collection failed")
+
+    async def collect(self, dry_run: bool) -> StorageGcReport | None:
+        # one collector at a time across all workers, the lock is released with the transaction
+        async with sessionmanager.session() as lock_session:
+            locked = await lock_session.execute(select(func.pg_try_advisory_xact_lock(GC_LOCK_ID)))
+            if not locked.scalar():
+                return None
+            report = StorageGcReport(dry_run=dry_run, started_at=datetime.utcnow())
+            started = time.monotonic()
+            async with sessionmanager.session() as session:
+                await self._collect_objects(session, report)
+                await self._collect_rows(session, report)
+            # expired sessions and crashed uploads hold no live data, they go even in a dry run
+            report.expired_uploads = await sweep_uploads()
+            report.stale_staged = await sweep_staged(settings.storage_gc_grace_seconds)
+            report.elapsed = time.monotonic() - started
+            report.objects_per_second = report.scanned_objects / report.elapsed if report.elapsed else 0
+        logger.info("Storage gc %s", report.json())
+        self.last_report = report
+        return report
+
+    async def _collect_objects(self, session, report: StorageGcReport) -> None:
+        grace_before = time.time() - settings.storage_gc_grace_seconds
+        async for batch in storage.iter():
+            report.scanned_objects += len(batch)
+            # uploads are written before their row is committed, recent objects are left alone
+            objects = [stat for stat in batch if stat.mtime < grace_before]
+            if not objects:
+                continue
+            references = {stat.key: storage.references(stat.key) for stat in objects}
+            for key, refs in references.items():
+                if source := thumbnail_source(key):
+                    references[key] = refs + storage.references(source)
+            referenced = await File.get_existing_paths(session, [ref for refs in references.values() for ref in refs])
+            await session.rollback()
+            orphans = [stat for stat in objects if referenced.isdisjoint(references[stat.key])]
+            # older uploads are referenced by an absolute path built from the working directory at
+            # the time, a different one now would make them look orphaned, so only objects/ is collected
+            legacy = [stat for stat in orphans if not stat.key.startswith(OBJECTS_DIR + '/')]
+            report.legacy_objects += len(legacy)
+            orphans = [stat for stat in orphans if stat.key.startswith(OBJECTS_DIR + '/')]
+            report.orphaned_objects += len(orphans)
+            report.reclaimed_bytes += sum(stat.size for stat in orphans)
+            if orphans and not report.dry_run:
+                await storage.delete([stat.key for stat in orphans])
+
+    async def _collect_rows(self, session, report: StorageGcReport) -> None:
+        last_id = 0
+        while rows := await File.get_paths_after(session, last_id, settings.storage_gc_batch_size):
+            await session.rollback()
+            last_id = rows[-1].id
+            report.scanned_rows += len(rows)
+            missing = await storage.missing([row.path for row in rows])
+            dangling = [row.id for row in rows if row.path in missing]
+            report.dangling_rows += len(dangling)
+            if dangling and not report.dry_run:
+                await File.delete_many(session, dangling)
+
+
+collector = StorageCollector()
@@ -11,6 +11,64 @@ class Settings(BaseSettings):
     secret_key: str
     access_token_expire_minutes: int
 
+    # per worker; the realtime broker and the two cache listeners each hold one connection for LISTEN
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = -1
+    db_pool_pre_ping: bool = False
+    db_pool_warmup: int = 5
+    db_prepared_statement_cache_size: int = 100
+    db_statement_cache_size: int = 100
+
+    # local or s3, the s3 backend needs aiobotocore installed
+    storage_backend: str = "local"
+    s3_bucket: str | None = None
+    s3_prefix: str = ""
+    s3_endpoint_url: str | None = None
+    s3_region: str | None = None
+    s3_access_key_id: str | None = None
+    s3_secret_access_key: str | None = None
+
+    # passlib's argon2 defaults, changing them rehashes passwords on the next login
+    argon2_time_cost: int = 2
+    argon2_memory_cost: int = 102400
+    argon2_parallelism: int = 8
+    hash_workers: int = 2
+    hash_queue_size: int = 32
+
+    principal_cache_size: int = 10000
+    principal_cache_ttl_seconds: int = 60
+    token_cache_size: int = 10000
+
+    # new chats go to users with agent_role, picked by round_robin, least_loaded or sticky
+    agent_role: str = "superuser"
+    agent_strategy: str = "least_loaded"
+    agent_refresh_seconds: int = 30
+
+    ws_send_queue_size: int = 100
+    chat_delete_batch_size: int = 1000
+
+    storage_gc_interval_seconds: int = 3600
+    storage_gc_grace_seconds: int = 3600
+    storage_gc_batch_size: int = 500
+    # only reports until turned off, read a report before letting it delete
+    storage_gc_dry_run: bool = True
+
+    upload_expire_hours: int = 24
+    upload_max_size: int = 4 * 1024 * 1024 * 1024
+    upload_concurrency: int = 4
+
+    thumbnail_workers: int = 2
+    # longest side in pixels; the first size is ?variant=thumb, every size is ?variant=thumb<size>
+    thumbnail_sizes: list[int] = [320]
+    thumbnail_quality: int = 80
+
+    download_cache_max_age: int = 86400
+    download_url_ttl_seconds: int = 3600
+    # e.g. /protected/ to let nginx serve attachments through X-Accel-Redirect
+    download_accel_prefix: str | None = None
+
     class Config:
         env_file = ".env"
 
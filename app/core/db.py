@@ -1,25 +1,136 @@
+import asyncio
 import contextlib
-from typing import AsyncIterator
+import logging
+import time
+from typing import AsyncIterator, Awaitable, Callable
 
+from sqlalchemy import event, exc, make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker, AsyncEngine, AsyncConnection
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from app.core.config import settings
+from app.core.schemas import PoolStats
+
+logger = logging.getLogger(__name__)
 
 DATABASE_URL = settings.database_url
 
 Base = declarative_base()
 
 
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats(size=self.size(), max_overflow=self._max_overflow, timeout=self._timeout)
+
+    def _do_get(self):
+        # only checkouts that find every connection in use count as waits
+        saturated = -1 < self._max_overflow <= self._overflow and self._pool.empty()
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.stats.timeouts += 1
+            raise
+        finally:
+            if saturated:
+                waited = time.perf_counter() - started
+                self.stats.waits += 1
+                self.stats.wait_seconds += waited
+                self.stats.max_wait_seconds = max(self.stats.max_wait_seconds, waited)
+
+    def report(self) -> PoolStats:
+        return self.stats.copy(update={'checked_out': self.checkedout(), 'checked_in': self.checkedin(),
+                                       'overflow': max(self.overflow(), 0)})
+
+
+def engine_options(host: str) -> dict:
+    options = {
+        'poolclass': InstrumentedPool,
+        'pool_size': settings.db_pool_size,
+        'max_overflow': settings.db_max_overflow,
+        'pool_timeout': settings.db_pool_timeout,
+        'pool_recycle': settings.db_pool_recycle,
+        'pool_pre_ping': settings.db_pool_pre_ping,
+    }
+    if make_url(host).get_driver_name() == 'asyncpg':
+        options['connect_args'] = {
+            'prepared_statement_cache_size': settings.db_prepared_statement_cache_size,
+            # 0 disables asyncpg's server-side statement cache, needed behind pgbouncer in transaction mode
+            'statement_cache_size': settings.db_statement_cache_size,
+        }
+    return options
+
+
+class Listener:
+    # keeps a LISTEN open in a background task, reconnecting a second after the connection is lost
+    def __init__(self, manager: 'DatabaseSessionManager', channel: str, callback: Callable,
+                 on_connect: Callable[[], Awaitable[None]] | None = None):
+        self.manager = manager
+        self.channel = channel
+        self.callback = callback
+        # notifications sent while nobody listened are lost, this resyncs after every (re)connect
+        self.on_connect = on_connect
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async with self.manager.listen(self.channel, self.callback) as terminated:
+                    if self.on_connect is not None:
+                        await self.on_connect()
+                    await terminated.wait()
+                logger.warning("Listener connection for %s was terminated", self.channel)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Failed to listen on %s", self.channel)
+            await asyncio.sleep(1)
+
+
 class DatabaseSessionManager:
     def __init__(self):
         self._engine: AsyncEngine | None = None
         self._sessionmaker: async_sessionmaker | None = None
 
     def init(self, host: str):
-        self._engine = create_async_engine(host)
+        self._engine = create_async_engine(host, **engine_options(host))
         self._sessionmaker = async_sessionmaker(autocommit=False, bind=self._engine)
+        pool = self._engine.pool
+
+        @event.listens_for(pool, 'connect')
+        def count_connect(dbapi_connection, connection_record):
+            pool.stats.connects += 1
+
+        @event.listens_for(pool, 'invalidate')
+        def count_invalidate(dbapi_connection, connection_record, exception):
+            pool.stats.invalidations += 1
+
+    async def warm_up(self, connections: int) -> None:
+        # open the connections up front so the first requests after a deploy skip connection setup
+        if self._engine is None:
+            raise Exception("DatabaseSessionManager is not initialized")
+        opened = await asyncio.gather(*(self._engine.connect().start() for _ in range(connections)),
+                                      return_exceptions=True)
+        await asyncio.gather(*(connection.close() for connection in opened if isinstance(connection, AsyncConnection)))
+        errors = [error for error in opened if isinstance(error, BaseException)]
+        if errors:
+            raise errors[0]
+
+    def pool_stats(self) -> PoolStats:
+        if self._engine is None:
+            raise Exception("DatabaseSessionManager is not initialized")
+        return self._engine.pool.report()
 
     async def close(self):
         if self._engine is None:
@@ -38,6 +149,34 @@ class DatabaseSessionManager:
             except Exception:
                 await connection.rollback()
 
+    @contextlib.asynccontextmanager
+    async def listen(self, channel: str, callback: Callable) -> AsyncIterator[asyncio.Event]:
+        if self._engine is None:
+            raise Exception("DatabaseSessionManager is not initialized")
+        terminated = asyncio.Event()
+        async with self._engine.connect() as connection:
+            raw_connection = await connection.get_raw_connection()
+            driver_connection = raw_connection.driver_connection
+
+            def on_terminate(_) -> None:
+                terminated.set()
+
+            # the connection goes back to the pool afterwards, nothing of this listen may stay on it
+            driver_connection.add_termination_listener(on_terminate)
+            try:
+                await driver_connection.add_listener(channel, callback)
+                try:
+                    yield terminated
+                finally:
+                    if not driver_connection.is_closed():
+                        await driver_connection.remove_listener(channel, callback)
+            finally:
+                driver_connection.remove_termination_listener(on_terminate)
+
+    def listener(self, channel: str, callback: Callable,
+                 on_connect: Callable[[], Awaitable[None]] | None = None) -> Listener:
+        return Listener(self, channel, callback, on_connect)
+
     @contextlib.asynccontextmanager
     async def session(self) -> AsyncIterator[AsyncSession]:
         if self._sessionmaker is None:
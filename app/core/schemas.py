@@ -0,0 +1,16 @@
+from pydantic import BaseModel
+
+
+class PoolStats(BaseModel):
+    size: int
+    max_overflow: int
+    timeout: float
+    checked_out: int = 0
+    checked_in: int = 0
+    overflow: int = 0
+    connects: int = 0
+    invalidations: int = 0
+    waits: int = 0
+    wait_seconds: float = 0
+    max_wait_seconds: float = 0
+    timeouts: int = 0
@@ -1,9 +1,21 @@
-from fastapi import FastAPI
+import logging
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
+from app.auth.cache import principals, tokens
+from app.chat.agents import agents
+from app.chat.realtime import broker
+from app.chat.storage_gc import collector
 from app.core.api import api_router
 from app.core.config import settings
 from app.core.db import sessionmanager
+from app.users.hashing import HashingBusy
+from app.utils.storage import storage
+from app.utils.thumbnails import thumbnails
+
+logger = logging.getLogger(__name__)
 
 origins = [
     'http://localhost',
@@ -29,6 +41,38 @@ app.add_middleware(
 )
 
 
+@app.exception_handler(HashingBusy)
+async def hashing_busy(request: Request, exc: HashingBusy):
+    return JSONResponse(status_code=503, content={'detail': 'Too many concurrent logins, retry shortly'},
+                        headers={'Retry-After': '1'})
+
+
+@app.on_event("startup")
+async def startup():
+    try:
+        await sessionmanager.warm_up(min(settings.db_pool_warmup, settings.db_pool_size))
+    except Exception:
+        logger.exception("Database pool warm-up failed")
+    await storage.start()
+    await principals.start()
+    await tokens.start()
+    await agents.start()
+    await broker.start()
+    await collector.start()
+    await thumbnails.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await principals.stop()
+    await tokens.stop()
+    await agents.stop()
+    await broker.stop()
+    await collector.stop()
+    await thumbnails.stop()
+    await storage.stop()
+
+
 @app.get('/')
 async def root():
     return {'app name': settings.app_name}
@@ -1,6 +1,29 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+from app.core.config import settings
+
+pwd_context = CryptContext(
+    schemes=["argon2"],
+    deprecated="auto",
+    argon2__time_cost=settings.argon2_time_cost,
+    # hashes below the configured time cost are upgraded on the next login
+    argon2__min_rounds=settings.argon2_time_cost,
+    argon2__memory_cost=settings.argon2_memory_cost,
+    argon2__parallelism=settings.argon2_parallelism,
+)
+
+# argon2-cffi releases the GIL, so threads hash in parallel without blocking the event loop
+executor = ThreadPoolExecutor(max_workers=settings.hash_workers, thread_name_prefix='argon2')
+slots = asyncio.Semaphore(settings.hash_workers + settings.hash_queue_size)
+# bulk work waits for a slot instead of being shed, but never takes more than one per worker
+bulk_slots = asyncio.Semaphore(settings.hash_workers)
+
+
+class HashingBusy(Exception):
+    pass
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -9,3 +32,28 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def get_hashed_password(password: str) -> str:
     return pwd_context.hash(password)
+
+
+async def run_hashing(func, *args):
+    # admission control: shed load instead of queueing logins without bound
+    if slots.locked():
+        raise HashingBusy()
+    async with slots:
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
+async def hash_password(password: str) -> str:
+    return await run_hashing(pwd_context.hash, password)
+
+
+async def hash_passwords(passwords: list[str]) -> list[str]:
+    async def one(password: str) -> str:
+        async with bulk_slots, slots:
+            return await asyncio.get_running_loop().run_in_executor(executor, pwd_context.hash, password)
+
+    return await asyncio.gather(*map(one, passwords))
+
+
+async def verify_and_update(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    # the second value is a new hash when the stored one uses outdated parameters
+    return await run_hashing(pwd_context.verify_and_update, plain_password, hashed_password)
@@ -1,20 +1,23 @@
-from typing import Type, TypeVar, TYPE_CHECKING
+from typing import Type, TypeVar, TYPE_CHECKING, Sequence
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, Boolean, DateTime, Table, ForeignKey
-from sqlalchemy.orm import Mapped, mapped_column, relationship, WriteOnlyMapped
+from sqlalchemy import Column, String, Integer, Boolean, DateTime, Table, ForeignKey, update
+from sqlalchemy import Index, Row, and_, func, insert, text, true
+from sqlalchemy.orm import Mapped, mapped_column, relationship, WriteOnlyMapped, raiseload
+from sqlalchemy.orm.interfaces import ORMOption
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.chat.associations import association_table
+from app.chat.associations import association_table, chat_reads
 from app.core.config import settings
 from app.core.db import Base
-from app.users.hashing import verify_password, get_hashed_password
-from app.users.schemas import UserCreate
+from app.users.hashing import verify_password, hash_password
 if TYPE_CHECKING:
     from app.chat.models import Chat, Message
 
 T = TypeVar('T', bound='User')
 
+# loader profiles: relationships raise unless a query opts into loading them
+PRINCIPAL: tuple[ORMOption, ...] = (raiseload('*'),)
 
 
 '''A = TypeVar('A', bound='Admin')
@@ -77,14 +80,18 @@ class Admin(Base):
 
 class User(Base):
     __tablename__ = 'users'
+    __table_args__ = (
+        # usernames are unique regardless of case, the same expression serves verify_username
+        Index('ix_users_username_lower', text('lower(username)'), unique=True),
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True, autoincrement=True)
     username: Mapped[str] = mapped_column(String(50), nullable=False)
     password: Mapped[str] = mapped_column(String(255), nullable=False)
-    role: Mapped[str] = mapped_column(String(100), default='guest')
+    role: Mapped[str] = mapped_column(String(100), default='guest', index=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
-    chats: Mapped[list['Chat']] = relationship("Chat", secondary=association_table, back_populates="users", lazy="selectin")
-    messages: Mapped[list['Message']] = relationship("Message", back_populates="user", lazy='selectin')
+    chats: Mapped[list['Chat']] = relationship("Chat", secondary=association_table, back_populates="users", lazy="raise")
+    messages: Mapped[list['Message']] = relationship("Message", back_populates="user", lazy='raise')
 
     def __repr__(self):
         return f"USER: {self.username} {self.password} {self.role}"
@@ -94,37 +101,98 @@ class User(Base):
 
     @classmethod
     async def verify_username(cls: Type[T], session: AsyncSession, username: str) -> T | None:
-        query = select(cls).where(cls.username == username)
+        query = select(cls).where(func.lower(cls.username) == func.lower(username)).options(*PRINCIPAL)
         result = await session.execute(query)
         return result.scalars().first()
 
     @classmethod
-    async def user_registration(cls: Type[T], session: AsyncSession, user: UserCreate) -> T:
-        user.password = get_hashed_password(user.password)
-        new_instance = cls(**user.dict())
-        session.add(new_instance)
+    async def create_many(cls: Type[T], session: AsyncSession, users: list[dict]) -> list[T]:
+        # one INSERT .. RETURNING, users come back in the order given; the caller commits
+        query = insert(cls).returning(cls, sort_by_parameter_order=True)
+        return (await session.scalars(query, users)).all()
+
+    @classmethod
+    async def get_existing_usernames(cls: Type[T], session: AsyncSession, usernames: list[str]) -> set[str]:
+        lowered = func.lower(cls.username)
+        query = select(lowered).where(lowered.in_([username.lower() for username in usernames]))
+        return set((await session.scalars(query)).all())
+
+    @classmethod
+    async def update_password(cls: Type[T], session: AsyncSession, user_id: int, password: str) -> None:
+        query = update(cls).where(cls.id == user_id).values(password=password)
+        await session.execute(query.execution_options(synchronize_session=False))
         await session.commit()
-        await session.refresh(new_instance)
-        return new_instance
 
     @classmethod
     async def get_superuser(cls: Type[T], session: AsyncSession) -> T:
-        user = select(cls).where(cls.role == "superuser")
+        user = select(cls).where(cls.role == "superuser").options(*PRINCIPAL)
         result = await session.execute(user)
         return result.scalars().first()
 
     @classmethod
-    async def get_by_id(cls: Type[T], session: AsyncSession, id: int) -> T | None:
-        user = select(cls).where(cls.id == id)
+    async def get_agent_loads(cls: Type[T], session: AsyncSession, role: str) -> list[Row]:
+        # memberships come through the user_id index, read state by the chat_reads primary key
+        query = (
+            select(cls.id, cls.username, func.count(association_table.c.chat_id).label('chats'),
+                   func.count(chat_reads.c.chat_id).filter(chat_reads.c.unread_count > 0).label('open'))
+            .outerjoin(association_table, association_table.c.user_id == cls.id)
+            .outerjoin(chat_reads, and_(chat_reads.c.chat_id == association_table.c.chat_id,
+                                        chat_reads.c.user_id == cls.id))
+            .where(cls.role == role)
+            .group_by(cls.id)
+            .order_by(cls.id)
+        )
+        result = await session.execute(query)
+        return result.all()
+
+    @classmethod
+    async def get_by_id(cls: Type[T], session: AsyncSession, id: int,
+                        options: Sequence[ORMOption] = PRINCIPAL) -> T | None:
+        user = select(cls).where(cls.id == id).options(*options)
         result = await session.execute(user)
         return result.scalars().first()
 
     @classmethod
-    async def get_all(cls: Type[T], session: AsyncSession, limit: int = 100, offset: int = 0) -> list[T]:
-        query = select(cls).offset(offset).limit(limit)
+    async def get_all(cls: Type[T], session: AsyncSession, limit: int = 100, offset: int = 0,
+                      options: Sequence[ORMOption] = PRINCIPAL) -> list[T]:
+        query = select(cls).offset(offset).limit(limit).options(*options)
         users = await session.execute(query)
         return users.scalars().all()
 
+    @classmethod
+    async def get_summaries(cls: Type[T], session: AsyncSession, after_id: int | None = None, limit: int = 100,
+                            role: str | None = None, created_from: datetime | None = None,
+                            created_to: datetime | None = None) -> list[Row]:
+        # plain rows, no identity map: counts and last activity come from one lateral per user
+        messages = Base.metadata.tables['messages']
+        activity = (
+            select(func.count().label('messages'), func.max(messages.c.created_at).label('last_activity'))
+            .where(messages.c.user_id == cls.id)
+            .lateral('activity')
+        )
+        chats = (
+            select(func.count()).select_from(association_table)
+            .where(association_table.c.user_id == cls.id)
+            .scalar_subquery()
+        )
+        query = (
+            select(cls.id, cls.username, cls.role, cls.created_at, activity.c.messages, activity.c.last_activity,
+                   chats.label('chats'))
+            .join(activity, true())
+            .order_by(cls.id)
+            .limit(limit)
+        )
+        if after_id is not None:
+            query = query.where(cls.id > after_id)
+        if role is not None:
+            query = query.where(cls.role == role)
+        if created_from is not None:
+            query = query.where(cls.created_at >= created_from)
+        if created_to is not None:
+            query = query.where(cls.created_at < created_to)
+        result = await session.execute(query)
+        return result.all()
+
     @classmethod
     async def create_superuser(cls: Type[T], session: AsyncSession) -> None:
         already_exist = await cls.verify_username(session, settings.admin_username)
@@ -132,12 +200,9 @@ class User(Base):
             return
         user = cls(
             username=settings.admin_username,
-            password=get_hashed_password(settings.admin_password),
+            password=await hash_password(settings.admin_password),
             role='superuser',
         )
         session.add(user)
         await session.commit()
         await session.refresh(user)
-
-
-
@@ -0,0 +1,41 @@
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.chat.models import Chat
+from app.users.hashing import hash_passwords
+from app.users.models import User
+from app.users.schemas import UserCreate, UserGetName, UserProvisionReport
+
+
+async def provision_users(session: AsyncSession, users: list[UserCreate], batch_size: int) -> UserProvisionReport:
+    report = UserProvisionReport()
+    seen: set[str] = set()
+    for start in range(0, len(users), batch_size):
+        batch = users[start:start + batch_size]
+        existing = await User.get_existing_usernames(session, [user.username for user in batch])
+        # no transaction is held open while the pool hashes
+        await session.rollback()
+        fresh = []
+        for user in batch:
+            key = user.username.lower()
+            if key in existing or key in seen:
+                report.skipped.append(user.username)
+                continue
+            seen.add(key)
+            fresh.append(user)
+        if not fresh:
+            continue
+        passwords = await hash_passwords([user.password for user in fresh])
+        try:
+            created = await User.create_many(session, [{'username': user.username, 'password': password}
+                                                       for user, password in zip(fresh, passwords)])
+            await Chat.create_for_users(session, [user.id for user in created], notify=False)
+            created = [UserGetName.from_orm(user) for user in created]
+            await session.commit()
+        except IntegrityError:
+            # a concurrent registration took one of the names, the whole batch is left out
+            await session.rollback()
+            report.failed.extend(user.username for user in fresh)
+            continue
+        report.created.extend(created)
+    return report
@@ -1,27 +1,65 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.auth.cache import principals, tokens
 from app.auth.jwt import get_current_user
-from app.chat.models import Message
-from app.core.db import get_db
+from app.auth.schemas import CacheStats
+from app.chat.models import Chat, USER_WITH_MESSAGES
+from app.core.db import get_db, sessionmanager
+from app.core.schemas import PoolStats
+from app.users.hashing import hash_password
 from app.users.models import User
-from app.users.schemas import UserGet, UserGetFull, UserCreate, UserBase
+from app.users.provisioning import provision_users
+from app.users.schemas import UserGet, UserGetFull, UserCreate, UserBase, UserProvisionReport, UserSummaryPage
 
 user_router = APIRouter()
 
 
-@user_router.get("/all", response_model=list[UserGet])
-async def read_users(offset: int = 0, limit: int = 100, db_session: AsyncSession = Depends(get_db)):
+@user_router.get("/all", response_model=list[UserGet] | UserSummaryPage)
+async def read_users(offset: int = 0, limit: int = Query(100, ge=1, le=1000), summary: bool = False,
+                     after_id: int | None = None, role: str | None = None, created_from: datetime | None = None,
+                     created_to: datetime | None = None, db_session: AsyncSession = Depends(get_db)):
+    if summary:
+        rows = await User.get_summaries(db_session, after_id, limit, role, created_from, created_to)
+        next_cursor = rows[-1].id if len(rows) == limit else None
+        return UserSummaryPage(users=rows, next_cursor=next_cursor)
     # print("whatafuck")
-    users = await User.get_all(db_session, limit, offset)
+    users = await User.get_all(db_session, limit, offset, USER_WITH_MESSAGES)
     # print(users[0].chats[0].messages[0].message)
     return users
 
 
 @user_router.get('/me', response_model=UserGetFull)
-async def get_me(current_user: UserGetFull = Depends(get_current_user)):
-    # print(current_user)
-    return current_user
+async def get_me(current_user: UserGetFull = Depends(get_current_user), db_session: AsyncSession = Depends(get_db)):
+    # the cached principal has no created_at
+    user = await User.get_by_id(db_session, current_user.id)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User Not Found")
+    return user
+
+
+@user_router.get('/principal-cache', response_model=CacheStats)
+async def get_principal_cache(current_user: UserGetFull = Depends(get_current_user)):
+    if current_user.role != "superuser":
+        raise HTTPException(status_code=400, detail="Permission denied!")
+    return principals.report()
+
+
+@user_router.get('/token-cache', response_model=CacheStats)
+async def get_token_cache(current_user: UserGetFull = Depends(get_current_user)):
+    if current_user.role != "superuser":
+        raise HTTPException(status_code=400, detail="Permission denied!")
+    return tokens.report()
+
+
+@user_router.get('/db-pool', response_model=PoolStats)
+async def get_db_pool(current_user: UserGetFull = Depends(get_current_user)):
+    if current_user.role != "superuser":
+        raise HTTPException(status_code=400, detail="Permission denied!")
+    return sessionmanager.pool_stats()
 
 
 @user_router.get("/{user_id}", response_model=UserGetFull)
@@ -34,20 +72,25 @@ async def get_user(user_id: int, db_session: AsyncSession = Depends(get_db)):
 
 
 @user_router.post("/create", response_model=UserGetFull, status_code=status.HTTP_201_CREATED)
-async def create_user(request: Request, user: UserCreate, db_session: AsyncSession = Depends(get_db)):
-    print(dict(request.headers.items()))
-    print(dict(request.query_params.items()))
-    print(await request.json())
-    print(await request.body())
-    exist = await User.verify_username(db_session, user.username)
-    if exist:
+async def create_user(user: UserCreate, db_session: AsyncSession = Depends(get_db)):
+    # the user, the chat with the superuser and the greeting are committed together,
+    # the unique username index rejects duplicates without a separate lookup
+    password = await hash_password(user.password)
+    try:
+        new_user, = await User.create_many(db_session, [{'username': user.username, 'password': password}])
+        await Chat.create_for_users(db_session, [new_user.id])
+        created = UserGetFull.from_orm(new_user)
+        await db_session.commit()
+    except IntegrityError:
+        await db_session.rollback()
         raise HTTPException(status_code=400, detail="User with this email already exists in the system")
-
-    new_user = await User.user_registration(db_session, user)
-    message = await Message.create_message(db_session, "Беседа начата", 0, new_user.id)
-    # print(new_user)
-    return new_user
-
-
+    return created
 
 
+@user_router.post("/bulk", response_model=UserProvisionReport, status_code=status.HTTP_201_CREATED)
+async def create_users(users: list[UserCreate], batch_size: int = Query(500, ge=1, le=5000),
+                       db_session: AsyncSession = Depends(get_db),
+                       current_user: UserGetFull = Depends(get_current_user)):
+    if current_user.role != "superuser":
+        raise HTTPException(status_code=400, detail="Permission denied!")
+    return await provision_users(db_session, users, batch_size)
@@ -42,3 +42,26 @@ class UserGetFull(UserBase):
 
     class Config:
         orm_mode = True
+
+
+class UserSummary(UserBase):
+    id: int
+    role: str | None
+    created_at: datetime | None
+    messages: int
+    chats: int
+    last_activity: datetime | None
+
+    class Config:
+        orm_mode = True
+
+
+class UserSummaryPage(BaseModel):
+    users: list[UserSummary] = []
+    next_cursor: int | None
+
+
+class UserProvisionReport(BaseModel):
+    created: list[UserGetName] = []
+    skipped: list[str] = []
+    failed: list[str] = []
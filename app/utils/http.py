@@ -0,0 +1,142 @@
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+
+from fastapi import HTTPException, Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from app.core.config import settings
+from app.utils.storage import storage, storage_root
+
+ZEROCOPY_EXTENSION = 'http.response.zerocopysend'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    tags = (tag.strip() for tag in if_none_match.split(','))
+    return etag.removeprefix('W/') in (tag.removeprefix('W/') for tag in tags)
+
+
+def not_modified_since(if_modified_since: str | None, mtime: float) -> bool:
+    if not if_modified_since:
+        return False
+    try:
+        return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def parse_range(range_header: str | None, size: int) -> tuple[int, int] | None:
+    # only a single range is served, anything else falls back to the full body as RFC 9110 allows
+    if not range_header or not range_header.startswith('bytes=') or ',' in range_header:
+        return None
+    start, _, end = range_header[6:].strip().partition('-')
+    try:
+        first = int(start) if start else None
+        last = int(end) if end else None
+    except ValueError:
+        return None
+    if first is None:
+        if last is None:
+            return None
+        # a suffix of zero bytes, or any suffix of an empty file, selects nothing
+        if last <= 0 or size == 0:
+            raise ValueError(range_header)
+        return max(size - last, 0), size - 1
+    if last is not None and first > last:
+        # syntactically invalid, the header is ignored
+        return None
+    if first >= size:
+        raise ValueError(range_header)
+    return first, size - 1 if last is None else min(last, size - 1)
+
+
+def content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def accel_path(key: str) -> str | None:
+    path = storage.local_path(key)
+    if not settings.download_accel_prefix or path is None:
+        return None
+    relative = os.path.relpath(path, storage_root())
+    if relative.startswith('..'):
+        return None
+    return settings.download_accel_prefix.rstrip('/') + '/' + quote(relative)
+
+
+class ObjectResponse(Response):
+    def __init__(self, key: str, status_code: int, headers: dict, start: int = 0, end: int = -1,
+                 send_header_only: bool = False):
+        self.key = key
+        self.status_code = status_code
+        self.start = start
+        self.count = end - start + 1 if end >= start else 0
+        self.send_header_only = send_header_only or not self.count
+        self.background = None
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+        if self.send_header_only:
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+            return
+        path = storage.local_path(self.key)
+        if path is not None and ZEROCOPY_EXTENSION in scope.get('extensions', {}):
+            # the server sendfile()s straight from the page cache when it offers the extension
+            with open(path, 'rb') as file:
+                await send({'type': ZEROCOPY_EXTENSION, 'file': file, 'offset': self.start,
+                            'count': self.count, 'more_body': False})
+            return
+        async for chunk in storage.get(self.key, self.start, self.count):
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+async def file_response(request: Request, key: str, filename: str, etag: str | None = None,
+                        immutable: bool = False, media_type: str = 'application/octet-stream') -> Response:
+    stat = await storage.stat(key)
+    if stat is None:
+        raise HTTPException(status_code=404, detail=f'File {filename} is missing from storage')
+    size = stat.size
+    etag = f'"{etag}"' if etag else f'"{int(stat.mtime * 1000):x}-{size:x}"'
+    cache_control = f'private, max-age={settings.download_cache_max_age}'
+    headers = {
+        'etag': etag,
+        'last-modified': formatdate(stat.mtime, usegmt=True),
+        'cache-control': f'{cache_control}, immutable' if immutable else cache_control,
+        'accept-ranges': 'bytes',
+    }
+    if_none_match = request.headers.get('if-none-match')
+    if etag_matches(if_none_match, etag) or \
+            (if_none_match is None and not_modified_since(request.headers.get('if-modified-since'),
+                                                          stat.mtime)):
+        return Response(status_code=304, headers=headers)
+    headers['content-disposition'] = content_disposition(filename)
+    headers['content-type'] = media_type
+    if (accel := accel_path(key)) is not None:
+        # the front proxy serves the body, ranges included, from its internal location
+        headers['x-accel-redirect'] = accel
+        return Response(status_code=200, headers=headers)
+    byte_range = None
+    if_range = request.headers.get('if-range')
+    if not if_range or if_range == etag or if_range == headers['last-modified']:
+        try:
+            byte_range = parse_range(request.headers.get('range'), size)
+        except ValueError:
+            return Response(status_code=416, headers={'content-range': f'bytes */{size}', **headers})
+    send_header_only = request.method == 'HEAD'
+    if byte_range is None:
+        headers['content-length'] = str(size)
+        return ObjectResponse(key, 200, headers, 0, size - 1, send_header_only)
+    start, end = byte_range
+    headers['content-range'] = f'bytes {start}-{end}/{size}'
+    headers['content-length'] = str(end - start + 1)
+    return ObjectResponse(key, 206, headers, start, end, send_header_only)
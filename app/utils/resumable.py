@@ -0,0 +1,145 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import re
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncIterator
+
+import aiofiles
+
+from app.core.config import settings
+from app.utils.storage import STAGING_DIR, remove_local, storage, storage_root
+from app.utils.uploads import StoredObject, object_key
+
+UPLOADS_DIR = 'uploads'
+UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def uploads_path() -> str:
+    return os.path.join(storage_root(), STAGING_DIR, UPLOADS_DIR)
+
+
+def data_path(upload_id: str) -> str:
+    return os.path.join(uploads_path(), upload_id)
+
+
+def meta_path(upload_id: str) -> str:
+    return os.path.join(uploads_path(), f'{upload_id}.json')
+
+
+def write_upload(meta: dict) -> None:
+    os.makedirs(uploads_path(), exist_ok=True)
+    open(data_path(meta['id']), 'xb').close()
+    with open(meta_path(meta['id']), 'x') as f:
+        json.dump(meta, f)
+
+
+async def create_upload(user_id: int, filename: str, length: int) -> dict:
+    now = datetime.utcnow()
+    meta = {
+        'id': uuid.uuid4().hex,
+        'user_id': user_id,
+        'filename': filename,
+        'length': length,
+        'created_at': now.isoformat(),
+        'expires_at': (now + timedelta(hours=settings.upload_expire_hours)).isoformat(),
+    }
+    await asyncio.to_thread(write_upload, meta)
+    return meta
+
+
+def read_upload(upload_id: str) -> dict:
+    with open(meta_path(upload_id)) as f:
+        meta = json.load(f)
+    meta['offset'] = os.path.getsize(data_path(upload_id))
+    return meta
+
+
+async def load_upload(upload_id: str, user_id: int) -> dict:
+    # the metadata lives next to the data on the shared volume, so any worker can serve the session
+    if not UPLOAD_ID.match(upload_id):
+        raise UploadError(404, f'Upload {upload_id} not found')
+    try:
+        meta = await asyncio.to_thread(read_upload, upload_id)
+    except FileNotFoundError:
+        raise UploadError(404, f'Upload {upload_id} not found')
+    if meta['user_id'] != user_id:
+        raise UploadError(404, f'Upload {upload_id} not found')
+    if datetime.fromisoformat(meta['expires_at']) < datetime.utcnow():
+        raise UploadError(410, f'Upload {upload_id} expired')
+    return meta
+
+
+async def append_upload(meta: dict, offset: int, chunks: AsyncIterator[bytes]) -> int:
+    async with aiofiles.open(data_path(meta['id']), 'ab') as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError(409, f'Upload {meta["id"]} is being written by another request')
+        size = os.fstat(f.fileno()).st_size
+        if size != offset:
+            raise UploadError(409, f'Upload-Offset {offset} does not match current offset {size}')
+        async for chunk in chunks:
+            if size + len(chunk) > meta['length']:
+                chunk = chunk[:meta['length'] - size]
+                await f.write(chunk)
+                size += len(chunk)
+                raise UploadError(413, f'Upload {meta["id"]} exceeds its declared length {meta["length"]}')
+            await f.write(chunk)
+            size += len(chunk)
+        return size
+
+
+def hash_upload(meta: dict) -> str:
+    path = data_path(meta['id'])
+    if os.path.getsize(path) != meta['length']:
+        raise UploadError(409, f'Upload {meta["id"]} is incomplete')
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def finish_upload(meta: dict) -> StoredObject:
+    sha256 = await asyncio.to_thread(hash_upload, meta)
+    created = await storage.put(data_path(meta['id']), object_key(sha256))
+    await asyncio.to_thread(remove_local, [meta_path(meta['id'])])
+    return StoredObject(object_key(sha256), meta['length'], sha256, created)
+
+
+def remove_expired_uploads() -> int:
+    now = datetime.utcnow()
+    removed = 0
+    try:
+        entries = os.scandir(uploads_path())
+    except FileNotFoundError:
+        return 0
+    with entries:
+        for entry in entries:
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path) as f:
+                    expires_at = datetime.fromisoformat(json.load(f)['expires_at'])
+            except (OSError, ValueError, KeyError):
+                continue
+            if expires_at < now:
+                remove_local([data_path(entry.name[:-5]), entry.path])
+                removed += 1
+    return removed
+
+
+async def sweep_uploads() -> int:
+    return await asyncio.to_thread(remove_expired_uploads)
@@ -0,0 +1,51 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+from app.core.config import settings
+
+SIGNED_DOWNLOAD_PATH = '/chat/signed/'
+
+
+def b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def signature(payload: str) -> str:
+    return b64encode(hmac.new(settings.secret_key.encode(), payload.encode(), hashlib.sha256).digest())
+
+
+def signing_epoch(now: float | None = None) -> int:
+    # urls only change once per epoch, so cached message pages and browser caches stay valid meanwhile
+    return int((time.time() if now is None else now) // settings.download_url_ttl_seconds)
+
+
+def sign_download(file_id: int, path: str, name: str, sha256: str | None = None, epoch: int | None = None) -> str:
+    epoch = signing_epoch() if epoch is None else epoch
+    expires = (epoch + 2) * settings.download_url_ttl_seconds
+    payload = b64encode(json.dumps([file_id, path, name, sha256, expires], separators=(',', ':')).encode())
+    return f'{payload}.{signature(payload)}'
+
+
+def verify_download(token: str) -> dict | None:
+    payload, _, sign = token.partition('.')
+    # compare_digest only takes ascii str, a crafted token may carry anything
+    if not hmac.compare_digest(sign.encode(), signature(payload).encode()):
+        return None
+    try:
+        file_id, path, name, sha256, expires = json.loads(b64decode(payload))
+    except ValueError:
+        return None
+    if expires < time.time():
+        return None
+    return {'id': file_id, 'path': path, 'name': name, 'sha256': sha256, 'expires': expires}
+
+
+def download_url(file_id: int, path: str, name: str, sha256: str | None = None) -> str:
+    return SIGNED_DOWNLOAD_PATH + sign_download(file_id, path, name, sha256)
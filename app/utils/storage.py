@@ -0,0 +1,256 @@
+import asyncio
+import contextlib
+import os
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Iterator, NamedTuple
+
+from app.core.config import settings
+
+STAGING_DIR = 'staging'
+READ_CHUNK_SIZE = 256 * 1024
+LIST_BATCH_SIZE = 1000
+
+
+class ObjectStat(NamedTuple):
+    key: str
+    size: int
+    mtime: float
+
+
+class StorageBackend(ABC):
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    @abstractmethod
+    async def put(self, staged: str, key: str) -> bool:
+        # moves a local staged file under key, returns False when the key already existed
+        ...
+
+    @abstractmethod
+    def get(self, key: str, start: int = 0, count: int | None = None) -> AsyncIterator[bytes]:
+        ...
+
+    async def fetch(self, key: str, target: str) -> str:
+        with open(target, 'wb') as f:
+            async for chunk in self.get(key):
+                await asyncio.to_thread(f.write, chunk)
+        return target
+
+    @abstractmethod
+    async def delete(self, keys: list[str]) -> None:
+        ...
+
+    @abstractmethod
+    async def stat(self, key: str) -> ObjectStat | None:
+        ...
+
+    async def missing(self, keys: list[str]) -> set[str]:
+        stats = await asyncio.gather(*map(self.stat, keys))
+        return {key for key, stat in zip(keys, stats) if stat is None}
+
+    @abstractmethod
+    def iter(self, prefix: str = '') -> AsyncIterator[list[ObjectStat]]:
+        ...
+
+    def local_path(self, key: str) -> str | None:
+        return None
+
+    def references(self, key: str) -> tuple[str, ...]:
+        # every form a files row may use for this object
+        return key,
+
+
+def storage_root() -> str:
+    return os.path.join(os.getcwd(), settings.file_storage_path)
+
+
+def scan_local(root: str, prefix: str) -> Iterator[ObjectStat]:
+    # depth-first scandir, only one directory listing is held at a time per level
+    stack = [os.path.join(root, prefix)]
+    skip = os.path.join(root, STAGING_DIR)
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.path == skip:
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        yield ObjectStat(os.path.relpath(entry.path, root), stat.st_size, stat.st_mtime)
+        except FileNotFoundError:
+            continue
+
+
+def next_batch(objects: Iterator[ObjectStat], size: int) -> list[ObjectStat]:
+    return [stat for _, stat in zip(range(size), objects)]
+
+
+def put_local(staged: str, path: str) -> bool:
+    if os.path.exists(path):
+        os.remove(staged)
+        # a fresh mtime keeps the collector's grace period from racing the new reference
+        os.utime(path)
+        return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(staged, path)
+    return True
+
+
+def remove_local(paths: list[str]) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def missing_local(paths: dict[str, str]) -> set[str]:
+    return {key for key, path in paths.items() if not os.path.exists(path)}
+
+
+def stat_local(path: str) -> ObjectStat | None:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return ObjectStat(path, stat.st_size, stat.st_mtime)
+
+
+class LocalBackend(StorageBackend):
+    def __init__(self, root: str):
+        self.root = root
+
+    def local_path(self, key: str) -> str:
+        # content-addressed objects are stored relative to the root, older uploads by absolute path
+        if os.path.isabs(key):
+            return key
+        return os.path.join(self.root, key)
+
+    def references(self, key: str) -> tuple[str, ...]:
+        # content-addressed rows are relative to the root, older uploads absolute
+        return key, os.path.join(self.root, key)
+
+    async def put(self, staged: str, key: str) -> bool:
+        return await asyncio.to_thread(put_local, staged, self.local_path(key))
+
+    async def get(self, key: str, start: int = 0, count: int | None = None) -> AsyncIterator[bytes]:
+        with open(self.local_path(key), 'rb') as f:
+            f.seek(start)
+            while count is None or count > 0:
+                size = READ_CHUNK_SIZE if count is None else min(READ_CHUNK_SIZE, count)
+                chunk = await asyncio.to_thread(f.read, size)
+                if not chunk:
+                    return
+                if count is not None:
+                    count -= len(chunk)
+                yield chunk
+
+    async def fetch(self, key: str, target: str) -> str:
+        return self.local_path(key)
+
+    async def delete(self, keys: list[str]) -> None:
+        await asyncio.to_thread(remove_local, [self.local_path(key) for key in keys])
+
+    async def stat(self, key: str) -> ObjectStat | None:
+        stat = await asyncio.to_thread(stat_local, self.local_path(key))
+        return stat and stat._replace(key=key)
+
+    async def missing(self, keys: list[str]) -> set[str]:
+        return await asyncio.to_thread(missing_local, {key: self.local_path(key) for key in keys})
+
+    async def iter(self, prefix: str = '') -> AsyncIterator[list[ObjectStat]]:
+        objects = scan_local(self.root, prefix)
+        while batch := await asyncio.to_thread(next_batch, objects, LIST_BATCH_SIZE):
+            yield batch
+
+
+class S3Backend(StorageBackend):
+    def __init__(self, bucket: str, prefix: str = '', **client_options):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client_options = client_options
+        self._client = None
+        self._stack: contextlib.AsyncExitStack | None = None
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    async def start(self) -> None:
+        # optional dependency, only needed when attachments live in a bucket
+        from aiobotocore.session import get_session
+
+        self._stack = contextlib.AsyncExitStack()
+        self._client = await self._stack.enter_async_context(
+            get_session().create_client('s3', **self.client_options))
+
+    async def stop(self) -> None:
+        if self._stack is not None:
+            await self._stack.aclose()
+            self._stack = None
+            self._client = None
+
+    async def put(self, staged: str, key: str) -> bool:
+        created = await self.stat(key) is None
+        if created:
+            with open(staged, 'rb') as body:
+                await self._client.put_object(Bucket=self.bucket, Key=self._key(key), Body=body)
+        else:
+            # like the local touch: a fresh LastModified keeps the collector's grace period
+            # over an old orphan until the row that now references it is committed
+            await self._client.copy_object(Bucket=self.bucket, Key=self._key(key),
+                                           CopySource={'Bucket': self.bucket, 'Key': self._key(key)},
+                                           MetadataDirective='REPLACE')
+        await asyncio.to_thread(remove_local, [staged])
+        return created
+
+    async def get(self, key: str, start: int = 0, count: int | None = None) -> AsyncIterator[bytes]:
+        options = {}
+        if start or count is not None:
+            end = '' if count is None else start + count - 1
+            options['Range'] = f'bytes={start}-{end}'
+        response = await self._client.get_object(Bucket=self.bucket, Key=self._key(key), **options)
+        async with response['Body'] as body:
+            async for chunk in body.iter_chunks(READ_CHUNK_SIZE):
+                yield chunk
+
+    async def delete(self, keys: list[str]) -> None:
+        for offset in range(0, len(keys), LIST_BATCH_SIZE):
+            objects = [{'Key': self._key(key)} for key in keys[offset:offset + LIST_BATCH_SIZE]]
+            await self._client.delete_objects(Bucket=self.bucket, Delete={'Objects': objects, 'Quiet': True})
+
+    async def stat(self, key: str) -> ObjectStat | None:
+        try:
+            response = await self._client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except self._client.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return ObjectStat(key, response['ContentLength'], response['LastModified'].timestamp())
+
+    async def iter(self, prefix: str = '') -> AsyncIterator[list[ObjectStat]]:
+        paginator = self._client.get_paginator('list_objects_v2')
+        async for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix),
+                                             PaginationConfig={'PageSize': LIST_BATCH_SIZE}):
+            yield [ObjectStat(item['Key'][len(self.prefix):], item['Size'], item['LastModified'].timestamp())
+                   for item in page.get('Contents', ())]
+
+
+def create_backend() -> StorageBackend:
+    if settings.storage_backend == 's3':
+        options = {
+            'endpoint_url': settings.s3_endpoint_url,
+            'region_name': settings.s3_region,
+            'aws_access_key_id': settings.s3_access_key_id,
+            'aws_secret_access_key': settings.s3_secret_access_key,
+        }
+        return S3Backend(settings.s3_bucket, settings.s3_prefix,
+                         **{name: value for name, value in options.items() if value is not None})
+    return LocalBackend(storage_root())
+
+
+storage = create_backend()
@@ -0,0 +1,82 @@
+import asyncio
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from app.core.config import settings
+
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp', 'tif', 'tiff'}
+EXIF_ORIENTATION = 0x0112
+THUMB_FORMAT = 'JPEG'
+THUMBNAIL_KEY = re.compile(r'^(.+)\.thumb\d+\.jpg$')
+
+
+def is_image(filename: str) -> bool:
+    return filename.rsplit('.', 1)[-1].lower() in IMAGE_EXTENSIONS
+
+
+def thumbnail_key(path: str, size: int) -> str:
+    # stored next to the original, identical uploads share one thumbnail
+    return f'{path}.thumb{size}.jpg'
+
+
+def thumbnail_source(key: str) -> str | None:
+    # the original a thumbnail was rendered from, it is kept as long as the original is
+    match = THUMBNAIL_KEY.match(key)
+    return match and match.group(1)
+
+
+def thumbnail_name(filename: str) -> str:
+    return filename.rsplit('.', 1)[0] + '.jpg'
+
+
+def make_thumbnails(source: str, targets: list[tuple[int, str]], quality: int) -> tuple[int, int] | None:
+    # renders every size from one decode, no targets only reads the dimensions
+    try:
+        with Image.open(source) as image:
+            width, height = image.size
+            if image.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8):
+                width, height = height, width
+            if not targets:
+                return width, height
+            largest = max(size for size, _ in targets)
+            # jpeg is decoded at a reduced scale, the full bitmap is never materialised
+            image.draft('RGB', (largest, largest))
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            for size, target in sorted(targets, reverse=True):
+                image.thumbnail((size, size))
+                image.save(target, THUMB_FORMAT, quality=quality, optimize=True)
+            return width, height
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        return None
+
+
+class ThumbnailPool:
+    def __init__(self):
+        self._executor: ProcessPoolExecutor | None = None
+        self._slots: asyncio.Semaphore | None = None
+
+    async def start(self) -> None:
+        if settings.thumbnail_workers > 0:
+            self._executor = ProcessPoolExecutor(max_workers=settings.thumbnail_workers)
+            # the executor queue is unbounded, only a few renders per worker are submitted at a time
+            self._slots = asyncio.Semaphore(settings.thumbnail_workers * 2)
+
+    async def stop(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def render(self, source: str, targets: list[tuple[int, str]]) -> tuple[int, int] | None:
+        if self._executor is None:
+            return None
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, make_thumbnails, source, targets,
+                                              settings.thumbnail_quality)
+
+
+thumbnails = ThumbnailPool()
@@ -1,18 +1,24 @@
-from datetime import datetime
+import asyncio
+import hashlib
 import os
+import time
+import uuid
+from datetime import datetime
+from typing import NamedTuple
 
-from app.core.config import settings
+import aiofiles
+from fastapi import UploadFile
 
+from app.utils.storage import STAGING_DIR, remove_local, storage, storage_root
 
-def generate_time() -> str:
-    date = datetime.utcnow()
-    return date.strftime("%Y%m")
+OBJECTS_DIR = 'objects'
 
 
-def generate_path() -> str:
-    storage_path = settings.file_storage_path + '/' + generate_time() + '/'
-    full_path = os.path.join(os.getcwd(), storage_path)
-    return full_path
+class StoredObject(NamedTuple):
+    path: str
+    size: int
+    sha256: str
+    created: bool
 
 
 def generate_filename(filename: str) -> str:
@@ -27,3 +33,50 @@ def generate_filename(filename: str) -> str:
 
     name = name + '_' + date.strftime("%d%H%M%S") + '.' + name_suffix
     return name
+
+
+def object_key(sha256: str) -> str:
+    return f'{OBJECTS_DIR}/{sha256[:2]}/{sha256[2:4]}/{sha256}'
+
+
+def staging_path() -> str:
+    path = os.path.join(storage_root(), STAGING_DIR)
+    os.makedirs(path, exist_ok=True)
+    return os.path.join(path, uuid.uuid4().hex)
+
+
+async def store_upload(file: UploadFile, chunk_size: int) -> StoredObject:
+    staged = await asyncio.to_thread(staging_path)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(staged, 'wb') as f:
+            while chunk := await file.read(chunk_size):
+                digest.update(chunk)
+                size += len(chunk)
+                await f.write(chunk)
+        sha256 = digest.hexdigest()
+        created = await storage.put(staged, object_key(sha256))
+    except BaseException:
+        await asyncio.to_thread(remove_local, [staged])
+        raise
+    return StoredObject(object_key(sha256), size, sha256, created)
+
+
+def remove_stale_staged(max_age: float) -> int:
+    # files left behind by uploads that crashed before their put; resumable sessions live in a
+    # subdirectory and expire on their own schedule
+    stale_before = time.time() - max_age
+    try:
+        entries = os.scandir(os.path.join(storage_root(), STAGING_DIR))
+    except FileNotFoundError:
+        return 0
+    with entries:
+        stale = [entry.path for entry in entries
+                 if entry.is_file(follow_symlinks=False) and entry.stat(follow_symlinks=False).st_mtime < stale_before]
+    remove_local(stale)
+    return len(stale)
+
+
+async def sweep_staged(max_age: float) -> int:
+    return await asyncio.to_thread(remove_stale_staged, max_age)
@@ -13,6 +13,7 @@ from app.core.db import Base
 from app.core.config import settings
 from app.users.models import User
 from app.chat.models import Chat, Message
+from app.auth.models import RevokedToken
 
 
 target_metadata = Base.metadata
@@ -0,0 +1,24 @@
+"""add messages chat cursor index
+
+Revision ID: 3d2ddb64b02e
+Revises: 3778eaec79d1
+Create Date: 2026-10-18 10:02:11.412730
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3d2ddb64b02e'
+down_revision = '3778eaec79d1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_messages_chat_id_created_at_id', 'messages', ['chat_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_messages_chat_id_created_at_id', table_name='messages')
@@ -0,0 +1,42 @@
+"""add lookup indexes
+
+Revision ID: 6fe3e953ea21
+Revises: fbda17e12aab
+Create Date: 2026-10-18 19:26:53.804117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6fe3e953ea21'
+down_revision = 'fbda17e12aab'
+branch_labels = None
+depends_on = None
+
+# messages.chat_id is already the leading column of ix_messages_chat_id_created_at_id
+INDEXES = [
+    ('ix_users_role', 'users', ['role']),
+    ('ix_messages_user_id', 'messages', ['user_id']),
+    ('ix_files_message_id', 'files', ['message_id']),
+    ('ix_files_path', 'files', ['path']),
+    ('ix_association_table_user_id', 'association_table', ['user_id']),
+]
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY cannot run inside the migration transaction
+    with op.get_context().autocommit_block():
+        # fails if two existing usernames differ only in case, those have to be renamed first
+        op.create_index('ix_users_username_lower', 'users', [sa.text('lower(username)')], unique=True,
+                        postgresql_concurrently=True, if_not_exists=True)
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_users_username_lower', table_name='users', postgresql_concurrently=True, if_exists=True)
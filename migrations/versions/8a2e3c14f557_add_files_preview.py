@@ -0,0 +1,30 @@
+"""add files preview
+
+Revision ID: 8a2e3c14f557
+Revises: 965f3c36e949
+Create Date: 2026-10-18 16:02:11.417209
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a2e3c14f557'
+down_revision = '965f3c36e949'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('files', sa.Column('width', sa.Integer(), nullable=True))
+    op.add_column('files', sa.Column('height', sa.Integer(), nullable=True))
+    op.add_column('files', sa.Column('thumbnail_path', sa.String(), nullable=True))
+    op.create_index(op.f('ix_files_thumbnail_path'), 'files', ['thumbnail_path'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_files_thumbnail_path'), table_name='files')
+    op.drop_column('files', 'thumbnail_path')
+    op.drop_column('files', 'height')
+    op.drop_column('files', 'width')
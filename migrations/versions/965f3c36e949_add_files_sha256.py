@@ -0,0 +1,26 @@
+"""add files sha256
+
+Revision ID: 965f3c36e949
+Revises: 2e170e347549
+Create Date: 2026-10-18 15:18:40.003516
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '965f3c36e949'
+down_revision = '2e170e347549'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('files', sa.Column('sha256', sa.String(length=64), nullable=True))
+    op.create_index(op.f('ix_files_sha256'), 'files', ['sha256'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_files_sha256'), table_name='files')
+    op.drop_column('files', 'sha256')
@@ -0,0 +1,29 @@
+"""add messages search vector
+
+Revision ID: df51636b6702
+Revises: e149d67e4f67
+Create Date: 2026-10-18 13:52:48.660129
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'df51636b6702'
+down_revision = 'e149d67e4f67'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('messages', sa.Column('search_vector', postgresql.TSVECTOR(),
+                                        sa.Computed("to_tsvector('russian', message)", persisted=True),
+                                        nullable=False))
+    op.create_index('ix_messages_search_vector', 'messages', ['search_vector'], unique=False,
+                    postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_messages_search_vector', table_name='messages', postgresql_using='gin')
+    op.drop_column('messages', 'search_vector')
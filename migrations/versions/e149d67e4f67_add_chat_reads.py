@@ -0,0 +1,38 @@
+"""add chat reads
+
+Revision ID: e149d67e4f67
+Revises: e4afdb820f47
+Create Date: 2026-10-18 12:40:05.217684
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e149d67e4f67'
+down_revision = 'e4afdb820f47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('chat_reads',
+    sa.Column('chat_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('last_read_message_id', sa.Integer(), nullable=True),
+    sa.Column('unread_count', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['chat_id'], ['chats.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('chat_id', 'user_id')
+    )
+    # existing history counts as read for every participant
+    op.execute(
+        "INSERT INTO chat_reads (chat_id, user_id, last_read_message_id, unread_count) "
+        "SELECT a.chat_id, a.user_id, (SELECT max(m.id) FROM messages m WHERE m.chat_id = a.chat_id), 0 "
+        "FROM association_table a"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('chat_reads')
@@ -0,0 +1,24 @@
+"""add chats version
+
+Revision ID: e4afdb820f47
+Revises: 3d2ddb64b02e
+Create Date: 2026-10-18 11:24:37.908113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4afdb820f47'
+down_revision = '3d2ddb64b02e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('chats', sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('chats', 'version')
@@ -0,0 +1,70 @@
+import contextlib
+from datetime import datetime, timedelta
+from typing import AsyncIterator
+
+import pytest
+from sqlalchemy import event, insert
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.compiler import compiles
+
+from app.auth.cache import principals
+from app.chat.agents import agents
+from app.chat.associations import association_table, chat_reads
+from app.chat.models import Chat, File, Message
+from app.core.db import Base, sessionmanager
+from app.users.models import User
+
+
+@compiles(TSVECTOR, 'sqlite')
+def compile_tsvector(type_, compiler, **kw):
+    return 'TEXT'
+
+
+async def register_functions(connection):
+    await connection.create_function('pg_notify', 2, lambda channel, payload: None)
+    await connection.create_function('to_tsvector', 2, lambda config, text: text, deterministic=True)
+
+
+async def seed() -> None:
+    # an admin and a guest sharing chat 1 with three messages, the last one has two files
+    async with sessionmanager.connect() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+        now = datetime.utcnow()
+        await connection.execute(insert(User), [
+            {'id': 1, 'username': 'admin', 'password': 'x', 'role': 'superuser', 'created_at': now},
+            {'id': 2, 'username': 'guest', 'password': 'x', 'role': 'guest', 'created_at': now},
+        ])
+        await connection.execute(insert(Chat), [{'id': 1, 'version': 3}])
+        members = [{'chat_id': 1, 'user_id': 1}, {'chat_id': 1, 'user_id': 2}]
+        await connection.execute(insert(association_table), members)
+        await connection.execute(insert(chat_reads), members)
+        await connection.execute(insert(Message), [
+            {'id': i, 'message': f'message {i}', 'chat_id': 1, 'user_id': 1 + i % 2,
+             'created_at': now + timedelta(seconds=i)} for i in range(1, 4)])
+        await connection.execute(insert(File), [
+            {'id': i, 'name': f'f{i}.txt', 'path': f'objects/f{i}', 'size': 1, 'message_id': 3} for i in (1, 2)])
+
+
+@pytest.fixture
+def database(tmp_path):
+    # a seeded sqlite database behind the app's sessionmanager, opened inside the test's event loop
+    @contextlib.asynccontextmanager
+    async def open_database() -> AsyncIterator[AsyncEngine]:
+        pytest.importorskip('aiosqlite')
+        sessionmanager.init(f'sqlite+aiosqlite:///{tmp_path}/test.db')
+        engine = sessionmanager._engine
+
+        @event.listens_for(engine.sync_engine, 'connect')
+        def on_connect(dbapi_connection, connection_record):
+            dbapi_connection.run_async(register_functions)
+
+        try:
+            await seed()
+            await agents.refresh()
+            principals.clear()
+            yield engine
+        finally:
+            await sessionmanager.close()
+
+    return open_database
@@ -0,0 +1,83 @@
+import types
+
+import pytest
+
+from app.auth import cache
+from app.auth.cache import REVOKED_PRUNE_MIN, PrincipalCache, TokenCache
+from app.users.models import User
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # both clocks the caches read, moved by hand
+    now = types.SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(cache, 'time', types.SimpleNamespace(monotonic=lambda: now.value, time=lambda: now.value))
+    return now
+
+
+def user(user_id: int) -> User:
+    return User(id=user_id, username=f'user{user_id}', role='guest')
+
+
+def test_principal_cache_evicts_least_recently_used(clock):
+    principals = PrincipalCache(max_size=2, ttl=60)
+    principals.put(user(1))
+    principals.put(user(2))
+    assert principals.get('user1').id == 1
+    principals.put(user(3))
+    assert principals.get('user2') is None
+    assert principals.get('user1').id == 1
+    assert principals.get('user3').id == 3
+    assert principals.report().evictions == 1
+
+
+def test_principal_cache_expires_and_invalidates(clock):
+    principals = PrincipalCache(max_size=10, ttl=60)
+    principals.put(user(1))
+    principals.put(user(2))
+    clock.value += 61
+    assert principals.get('user1') is None
+    principals.invalidate('user2')
+    assert principals.get('user2') is None
+    stats = principals.report()
+    assert (stats.expirations, stats.invalidations, stats.size) == (1, 1, 0)
+
+
+def test_token_cache_evicts_and_expires(clock):
+    tokens = TokenCache(max_size=2)
+    tokens.put('a', {'sub': 'a', 'exp': clock.value + 10})
+    tokens.put('b', {'sub': 'b', 'exp': clock.value + 100})
+    tokens.put('no-exp', {'sub': 'c'})
+    assert tokens.get('a')['sub'] == 'a'
+    tokens.put('c', {'sub': 'c', 'exp': clock.value + 100})
+    assert tokens.get('b') is None
+    clock.value += 11
+    assert tokens.get('a') is None
+    assert tokens.get('c')['sub'] == 'c'
+    assert tokens.get('no-exp') is None
+    stats = tokens.report()
+    assert (stats.evictions, stats.expirations) == (1, 1)
+
+
+def test_token_cache_revocation_expires(clock):
+    tokens = TokenCache(max_size=10)
+    tokens.put('a', {'sub': 'a', 'exp': clock.value + 100})
+    tokens.revoke('a', clock.value + 100)
+    assert tokens.get('a') is None
+    assert tokens.is_revoked('a')
+    clock.value += 101
+    assert not tokens.is_revoked('a')
+    assert tokens.report().revoked == 0
+
+
+def test_token_cache_prunes_expired_revocations(clock):
+    tokens = TokenCache(max_size=10)
+    for i in range(REVOKED_PRUNE_MIN - 2):
+        tokens.revoke(f'old{i}', clock.value + 10)
+    tokens.revoke('live', clock.value + 1000)
+    clock.value += 11
+    # expired entries stay until the set reaches the threshold, never checked tokens included
+    assert tokens.report().revoked == REVOKED_PRUNE_MIN - 1
+    tokens.revoke('new', clock.value + 1000)
+    assert tokens.report().revoked == 2
+    assert tokens.is_revoked('live') and tokens.is_revoked('new')
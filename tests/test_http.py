@@ -0,0 +1,23 @@
+import pytest
+
+from app.utils.http import parse_range
+
+
+@pytest.mark.parametrize('header, expected', [
+    (None, None),
+    ('bytes=0-', (0, 9)),
+    ('bytes=2-100', (2, 9)),
+    ('bytes=-3', (7, 9)),
+    ('bytes=-30', (0, 9)),
+    ('bytes=5-3', None),
+    ('bytes=a-b', None),
+    ('bytes=0-1,4-5', None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 10) == expected
+
+
+@pytest.mark.parametrize('header, size', [('bytes=-0', 10), ('bytes=10-', 10), ('bytes=-3', 0)])
+def test_parse_range_unsatisfiable(header, size):
+    with pytest.raises(ValueError):
+        parse_range(header, size)
@@ -0,0 +1,29 @@
+import asyncio
+
+from app.chat.imports import iter_csv, iter_ndjson
+
+
+async def stream(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+def collect(rows) -> list:
+    async def run():
+        return [row async for row in rows]
+
+    return asyncio.run(run())
+
+
+def test_ndjson_invalid_utf8_fails_only_its_line():
+    rows = collect(iter_ndjson(stream(b'{"a": 1}\n\xff\xfe\n', b'{"b": 2}\n')))
+    assert rows[0] == (1, {'a': 1})
+    assert rows[1][0] == 2 and rows[1][1].startswith('Invalid UTF-8')
+    assert rows[2] == (3, {'b': 2})
+
+
+def test_csv_invalid_utf8_fails_its_whole_record():
+    data = b'chat_id,user_id,message\n1,2,"multi\n\xff line"\n1,2,ok\n'
+    rows = collect(iter_csv(stream(data)))
+    assert rows[0][0] == 2 and rows[0][1].startswith('Invalid UTF-8')
+    assert rows[1] == (4, {'chat_id': '1', 'user_id': '2', 'message': 'ok'})
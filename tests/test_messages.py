@@ -0,0 +1,41 @@
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from app.chat.models import Chat, Message
+from app.core.db import sessionmanager
+
+
+async def page(**cursor) -> tuple[list[int], int | None]:
+    async with sessionmanager.session() as session:
+        messages, next_cursor = await Message.get_messages_page(session, 1, limit=2, **cursor)
+        return [message.id for message in messages], next_cursor
+
+
+def test_messages_page_cursors(database):
+    async def run():
+        async with database():
+            assert await page() == ([2, 3], 2)
+            assert await page(before=2) == ([1], None)
+            assert await page(after=1) == ([2, 3], None)
+
+    asyncio.run(run())
+
+
+def test_messages_page_missing_cursor(database):
+    # a cursor message that was deleted, or belongs to another chat, pages by id instead of returning nothing
+    async def run():
+        async with database():
+            assert await page(after=0) == ([1, 2], 2)
+            assert await page(after=999) == ([], None)
+            assert await page(before=999) == ([2, 3], 2)
+            async with sessionmanager.session() as session:
+                await session.execute(insert(Chat), [{'id': 2, 'version': 0}])
+                await session.execute(insert(Message), [{'id': 2000, 'message': 'elsewhere', 'chat_id': 2,
+                                                         'user_id': 1, 'created_at': datetime(2000, 1, 1)}])
+                await session.commit()
+            assert await page(before=2000) == ([2, 3], 2)
+            assert await page(after=2000) == ([], None)
+
+    asyncio.run(run())
@@ -0,0 +1,29 @@
+from app.utils.signing import sign_download, signing_epoch, verify_download
+
+SHA256 = '2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824'
+
+
+def test_sign_verify_round_trip():
+    file = verify_download(sign_download(7, 'objects/2c/f2/x', 'report é.pdf', SHA256))
+    assert file['id'] == 7
+    assert file['path'] == 'objects/2c/f2/x'
+    assert file['name'] == 'report é.pdf'
+    assert file['sha256'] == SHA256
+
+
+def test_verify_rejects_tampering():
+    token = sign_download(7, 'objects/2c/f2/x', 'a.txt', SHA256)
+    payload, _, sign = token.partition('.')
+    other, _, _ = sign_download(8, 'objects/2c/f2/x', 'a.txt', SHA256).partition('.')
+    assert verify_download(f'{other}.{sign}') is None
+    assert verify_download(f'{payload}.{sign[:-1]}') is None
+    assert verify_download(payload) is None
+    assert verify_download('abc.é') is None
+    assert verify_download('é.é') is None
+
+
+def test_verify_rejects_expired():
+    expired_epoch = signing_epoch() - 2
+    assert verify_download(sign_download(7, 'objects/x', 'a.txt', epoch=expired_epoch)) is None
+    # a link stays valid for at least one full ttl after it was signed
+    assert verify_download(sign_download(7, 'objects/x', 'a.txt', epoch=signing_epoch() - 1)) is not None
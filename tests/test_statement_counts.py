@@ -0,0 +1,58 @@
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import event
+
+from app.auth.jwt import create_access_token
+from app.main import app
+
+
+async def request(method: str, url: str, username: str | None = None, body=None) -> tuple[int, object]:
+    path, _, query = url.partition('?')
+    headers = [(b'host', b'test'), (b'content-type', b'application/json')]
+    if username is not None:
+        headers.append((b'authorization', f'Bearer {create_access_token({"sub": username})}'.encode()))
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+             'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+             'root_path': '', 'headers': headers, 'client': ('127.0.0.1', 1), 'server': ('test', 80)}
+    messages = [{'type': 'http.request', 'body': json.dumps(body).encode() if body is not None else b''}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    payload = b''.join(message.get('body', b'') for message in sent[1:])
+    return sent[0]['status'], json.loads(payload) if payload else None
+
+
+# statements per request; the first one of authenticated endpoints is the principal lookup on a cold cache.
+# inboxes, summaries and search use LATERAL joins and full text search, tests/test_query_plans.py covers them on postgres
+ENDPOINTS = [
+    ('GET', '/user/me', 'guest', None, 2),
+    ('GET', '/user/all', None, None, 3),
+    ('GET', '/chat/1', 'guest', None, 1 + 3 + 1),
+    ('GET', '/chat/1/messages?limit=2', 'guest', None, 1 + 1 + 1 + 2),
+    ('GET', '/chat/1/messages?limit=2', 'admin', None, 1 + 1 + 2),
+    ('POST', '/chat/1/read', 'guest', {'message_id': 3}, 1 + 3),
+    ('POST', '/user/create', None, {'username': 'newcomer', 'password': 'secret'}, 6),
+]
+
+
+@pytest.mark.parametrize('method, url, username, body, expected', ENDPOINTS,
+                         ids=[f'{method} {url}' for method, url, *_ in ENDPOINTS])
+def test_statement_count(database, method, url, username, body, expected):
+    async def run():
+        async with database() as engine:
+            statements = []
+            event.listen(engine.sync_engine, 'before_cursor_execute',
+                         lambda conn, cursor, statement, *args: statements.append(statement))
+            status, payload = await request(method, url, username, body)
+            assert status < 300, payload
+            assert len(statements) == expected, '\n\n'.join(statements)
+
+    asyncio.run(run())
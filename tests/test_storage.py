@@ -0,0 +1,117 @@
+import asyncio
+import json
+import os
+import socket
+import time
+
+import pytest
+
+from app.utils.storage import LocalBackend, S3Backend, StorageBackend
+
+KEY = 'objects/2c/f2/2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824'
+
+
+def stage(tmp_path, data: bytes) -> str:
+    path = tmp_path / f'staged-{time.monotonic_ns()}'
+    path.write_bytes(data)
+    return str(path)
+
+
+async def read(backend, key: str) -> bytes:
+    return b''.join([chunk async for chunk in backend.get(key)])
+
+
+def test_local_put_dedupe_refreshes_mtime(tmp_path):
+    backend = LocalBackend(str(tmp_path / 'root'))
+
+    async def run():
+        assert await backend.put(stage(tmp_path, b'hello'), KEY)
+        os.utime(backend.local_path(KEY), (0, 0))
+        staged = stage(tmp_path, b'hello')
+        assert not await backend.put(staged, KEY)
+        assert not os.path.exists(staged)
+        assert (await backend.stat(KEY)).mtime > time.time() - 60
+        assert await read(backend, KEY) == b'hello'
+
+    asyncio.run(run())
+
+
+def test_incomplete_backend_fails_at_construction():
+    class WriteOnly(StorageBackend):
+        async def put(self, staged: str, key: str) -> bool:
+            return True
+
+    with pytest.raises(TypeError):
+        WriteOnly()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def s3_endpoint():
+    moto_server = pytest.importorskip('moto.server')
+    pytest.importorskip('aiobotocore')
+    port = free_port()
+    server = moto_server.ThreadedMotoServer(ip_address='127.0.0.1', port=port)
+    server.start()
+    yield f'http://127.0.0.1:{port}'
+    server.stop()
+
+
+def test_s3_backend(tmp_path, s3_endpoint):
+    backend = S3Backend('attachments', 'chat/', endpoint_url=s3_endpoint, region_name='us-east-1',
+                        aws_access_key_id='test', aws_secret_access_key='test')
+
+    async def run():
+        await backend.start()
+        try:
+            await backend._client.create_bucket(Bucket='attachments')
+            staged = stage(tmp_path, b'hello')
+            assert await backend.put(staged, KEY)
+            assert not os.path.exists(staged)
+            first = await backend.stat(KEY)
+            assert first.size == 5
+            assert await read(backend, KEY) == b'hello'
+            assert b''.join([chunk async for chunk in backend.get(KEY, 1, 3)]) == b'ell'
+            # LastModified has a one second resolution
+            await asyncio.sleep(1.1)
+            assert not await backend.put(stage(tmp_path, b'hello'), KEY)
+            assert (await backend.stat(KEY)).mtime > first.mtime
+            listed = [stat.key async for batch in backend.iter('objects/') for stat in batch]
+            assert listed == [KEY]
+            assert await backend.missing([KEY, 'objects/00/00/none']) == {'objects/00/00/none'}
+            await backend.delete([KEY])
+            assert await backend.stat(KEY) is None
+        finally:
+            await backend.stop()
+
+    asyncio.run(run())
+
+
+def test_sweep_staging(tmp_path, monkeypatch):
+    from app.utils import resumable, uploads
+
+    monkeypatch.setattr(uploads, 'storage_root', lambda: str(tmp_path))
+    monkeypatch.setattr(resumable, 'storage_root', lambda: str(tmp_path))
+    expired = asyncio.run(resumable.create_upload(1, 'a.txt', 5))
+    live = asyncio.run(resumable.create_upload(1, 'b.txt', 5))
+    meta = json.loads(open(resumable.meta_path(expired['id'])).read())
+    meta['expires_at'] = '2000-01-01T00:00:00'
+    with open(resumable.meta_path(expired['id']), 'w') as f:
+        json.dump(meta, f)
+    staging = tmp_path / 'staging'
+    (staging / 'crashed').write_bytes(b'x')
+    os.utime(staging / 'crashed', (0, 0))
+    (staging / 'in-flight').write_bytes(b'x')
+
+    async def run():
+        assert await resumable.sweep_uploads() == 1
+        assert await uploads.sweep_staged(3600) == 1
+
+    asyncio.run(run())
+    assert sorted(path.name for path in staging.iterdir()) == ['in-flight', 'uploads']
+    assert sorted(os.listdir(resumable.uploads_path())) == sorted([live['id'], live['id'] + '.json'])
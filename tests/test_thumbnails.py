@@ -0,0 +1,28 @@
+from PIL import Image
+
+from app.utils.thumbnails import make_thumbnails, thumbnail_key, thumbnail_source
+
+
+def test_make_thumbnails_renders_every_size(tmp_path):
+    source = tmp_path / 'photo.png'
+    Image.new('RGBA', (1200, 600), (255, 0, 0, 128)).save(source)
+    targets = [(320, str(tmp_path / 'small.jpg')), (960, str(tmp_path / 'large.jpg'))]
+    assert make_thumbnails(str(source), targets, 80) == (1200, 600)
+    with Image.open(tmp_path / 'small.jpg') as small, Image.open(tmp_path / 'large.jpg') as large:
+        assert small.size == (320, 160)
+        assert large.size == (960, 480)
+        assert small.format == large.format == 'JPEG'
+
+
+def test_make_thumbnails_without_targets_reads_dimensions(tmp_path):
+    source = tmp_path / 'photo.jpg'
+    Image.new('RGB', (30, 40)).save(source)
+    assert make_thumbnails(str(source), [], 80) == (30, 40)
+    (tmp_path / 'text.jpg').write_text('not an image')
+    assert make_thumbnails(str(tmp_path / 'text.jpg'), [], 80) is None
+
+
+def test_thumbnail_source():
+    key = 'objects/2c/f2/2cf24dba'
+    assert thumbnail_source(thumbnail_key(key, 320)) == key
+    assert thumbnail_source(key) is None